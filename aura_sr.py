@@ -2,20 +2,25 @@
 # based on the unofficial lucidrains/gigagan-pytorch repository. Heavily modified from there.
 #
 # https://mingukkang.github.io/GigaGAN/
-from math import log2, ceil
-from functools import partial
-from typing import Any, Optional, List, Iterable
+from contextlib import nullcontext
+from math import log2
+from functools import partial, lru_cache
+from itertools import chain
+from typing import Any, Callable, Optional, List, Iterable, Iterator, Tuple
 
+import numpy as np
 import torch
-from torchvision import transforms
 from PIL import Image
 from torch import nn, einsum, Tensor
 import torch.nn.functional as F
 
 from einops import rearrange, repeat, reduce
 from einops.layers.torch import Rearrange
-from torchvision.utils import save_image
-import math
+import threading
+
+from .constants import ATTENTION_BACKENDS, CONV_MODES, UPSCALE_MODES, PRECISIONS, STREAMING_MODES
+from .scheduler import TileScheduler
+from .streaming import open_row_writer
 
 
 def get_same_padding(size, kernel, dilation, stride):
@@ -50,6 +55,10 @@ class AdaptiveConv2DMod(nn.Module):
         )
 
         self.demod = demod
+        self.conv_mode = "weight"
+
+        # fully modulated and demodulated (o, i, k, k) kernel for a fixed style, see UnetUpsampler.fixed_style_weights
+        self.baked_weights = None
 
         nn.init.kaiming_normal_(
             self.weights, a=0, mode="fan_in", nonlinearity="leaky_relu"
@@ -70,6 +79,10 @@ class AdaptiveConv2DMod(nn.Module):
 
         b, h = fmap.shape[0], fmap.shape[-2]
 
+        if exists(self.baked_weights):
+            padding = get_same_padding(h, self.kernel, self.dilation, self.stride)
+            return F.conv2d(fmap, self.baked_weights, padding=padding)
+
         # account for feature map that has been expanded by the scale in the first dimension
         # due to multiscale inputs and outputs
 
@@ -86,6 +99,24 @@ class AdaptiveConv2DMod(nn.Module):
                     kernel_mod, "b ... -> (s b) ...", s=b // kernel_mod.shape[0]
                 )
 
+        padding = get_same_padding(h, self.kernel, self.dilation, self.stride)
+
+        if self.conv_mode == "activation":
+            return self.forward_activation(fmap, mod, kernel_mod, padding)
+
+        weights = self.modulate_weights(mod, kernel_mod)
+
+        fmap = rearrange(fmap, "b c h w -> 1 (b c) h w")
+
+        weights = rearrange(weights, "b o ... -> (b o) ...")
+
+        fmap = F.conv2d(fmap, weights, padding=padding, groups=b)
+
+        return rearrange(fmap, "1 (b o) ... -> b o ...", b=b)
+
+    def modulate_weights(self, mod: Tensor, kernel_mod: Optional[Tensor] = None):
+        b = mod.shape[0]
+
         # prepare weights for modulation
 
         weights = self.weights
@@ -97,7 +128,7 @@ class AdaptiveConv2DMod(nn.Module):
 
             assert exists(kernel_mod) and kernel_mod.numel() > 0
 
-            kernel_attn = kernel_mod.softmax(dim=-1)
+            kernel_attn = kernel_mod.float().softmax(dim=-1).to(weights.dtype)
             kernel_attn = rearrange(kernel_attn, "b n -> b n 1 1 1 1")
 
             weights = reduce(weights * kernel_attn, "b n ... -> b ...", "sum")
@@ -110,20 +141,74 @@ class AdaptiveConv2DMod(nn.Module):
 
         if self.demod:
             inv_norm = (
-                reduce(weights**2, "b o i k1 k2 -> b o 1 1 1", "sum")
+                reduce(weights.float() ** 2, "b o i k1 k2 -> b o 1 1 1", "sum")
                 .clamp(min=self.eps)
                 .rsqrt()
             )
-            weights = weights * inv_norm
+            weights = weights * inv_norm.to(weights.dtype)
 
-        fmap = rearrange(fmap, "b c h w -> 1 (b c) h w")
+        return weights
 
-        weights = rearrange(weights, "b o ... -> (b o) ...")
+    def forward_activation(
+        self, fmap, mod: Tensor, kernel_mod: Optional[Tensor], padding: int
+    ):
+        """
+        same result as the weight modulation path, but the style is applied to the
+        input activations and the demodulation to the outputs, so that the convolution
+        itself runs batched with weights shared by every sample:
 
-        padding = get_same_padding(h, self.kernel, self.dilation, self.stride)
-        fmap = F.conv2d(fmap, weights, padding=padding, groups=b)
+        conv(x, sum_n a_n w_n * s) * d == sum_n a_n conv(x * s, w_n) * d
 
-        return rearrange(fmap, "1 (b o) ... -> b o ...", b=b)
+        the adaptive kernels are stacked along the output channels and mixed afterwards,
+        which trades num_conv_kernels times the conv work for never materialising
+        per-sample (b, o, i, k, k) weights
+        """
+
+        n = self.weights.shape[0]
+        scale = mod + 1
+
+        fmap = fmap * rearrange(scale, "b i -> b i 1 1")
+
+        weights = rearrange(self.weights, "n o ... -> (n o) ...")
+        if is_channels_last(fmap):
+            weights = weights.contiguous(memory_format=torch.channels_last)
+        fmap = F.conv2d(fmap, weights, padding=padding)
+
+        if self.adaptive:
+            assert exists(kernel_mod) and kernel_mod.numel() > 0
+
+            kernel_attn = kernel_mod.float().softmax(dim=-1)
+            if is_channels_last(fmap):
+                # mixed over the innermost (channel) dim of the NHWC memory, which stays NHWC
+                fmap = rearrange(fmap.permute(0, 2, 3, 1), "b h w (n o) -> b h w n o", n=n)
+                fmap = einsum("b n, b h w n o -> b h w o", kernel_attn.to(fmap.dtype), fmap).permute(0, 3, 1, 2)
+            else:
+                fmap = rearrange(fmap, "b (n o) h w -> b n o h w", n=n)
+                fmap = einsum("b n, b n o h w -> b o h w", kernel_attn.to(fmap.dtype), fmap)
+
+        if not self.demod:
+            return fmap
+
+        # squared norm of the modulated kernels, without building them (in fp32):
+        # sum_i s_i^2 sum_k (sum_n a_n w_n)^2 == sum_i s_i^2 sum_nm a_n a_m <w_n, w_m>
+
+        weights = rearrange(self.weights.float(), "n o i k1 k2 -> n o i (k1 k2)")
+        scale = scale.float()
+
+        if self.adaptive:
+            gram = einsum("n o i k, m o i k -> n m o i", weights, weights)
+            norm = einsum("n m o i, b i -> b n m o", gram, scale**2)
+            norm = einsum("b n, b m, b n m o -> b o", kernel_attn, kernel_attn, norm)
+        else:
+            gram = reduce(weights[0] ** 2, "o i k -> o i", "sum")
+            norm = einsum("o i, b i -> b o", gram, scale**2)
+
+        inv_norm = norm.clamp(min=self.eps).rsqrt().to(fmap.dtype)
+        return fmap * rearrange(inv_norm, "b o -> b o 1 1")
+
+
+# elements of the blocks the 'chunked' attention backend works on at once (16MB in fp32)
+ATTENTION_CHUNK_SIZE = 1 << 22
 
 
 class Attend(nn.Module):
@@ -134,16 +219,62 @@ class Attend(nn.Module):
         self.scale = nn.Parameter(torch.randn(1))
         self.flash = flash
 
+        # one of ATTENTION_BACKENDS, None is 'sdpa' with flash and 'math' without
+        self.backend = None
+
     def flash_attn(self, q, k, v):
+        # the fused kernels accumulate the softmax in fp32 for half precision inputs
         q, k, v = map(lambda t: t.contiguous(), (q, k, v))
         out = F.scaled_dot_product_attention(
             q, k, v, dropout_p=self.dropout if self.training else 0.0
         )
         return out
 
+    def chunked_attn(self, q, k, v, chunk_size: Optional[int] = None):
+        # the math backend in blocks of (batch * heads, queries, keys) of at most chunk_size elements
+        # (ATTENTION_CHUNK_SIZE by default), the softmax is accumulated across the key blocks (online softmax, in fp32)
+        chunk_size = default(chunk_size, ATTENTION_CHUNK_SIZE)
+        scale = q.shape[-1] ** -0.5
+        batch_shape, i, j = q.shape[:-2], q.shape[-2], k.shape[-2]
+        q, k, v = map(lambda t: t.reshape(-1, *t.shape[-2:]), (q, k, v))
+        n = q.shape[0]
+
+        key_block = min(j, chunk_size)
+        query_block = min(i, max(1, chunk_size // key_block))
+        head_block = min(n, max(1, chunk_size // (query_block * key_block)))
+
+        out = q.new_empty((n, i, v.shape[-1]))
+        for h in range(0, n, head_block):
+            for s in range(0, i, query_block):
+                qb = q[h:h + head_block, s:s + query_block]
+                row_max = qb.new_full(qb.shape[:-1], -torch.inf, dtype=torch.float32)
+                row_sum = torch.zeros_like(row_max)
+                acc = torch.zeros((*qb.shape[:-1], v.shape[-1]), dtype=torch.float32, device=q.device)
+
+                for t in range(0, j, key_block):
+                    kb, vb = k[h:h + head_block, t:t + key_block], v[h:h + head_block, t:t + key_block]
+                    sim = (qb @ kb.transpose(-1, -2)).float() * scale
+
+                    new_max = torch.maximum(row_max, sim.amax(dim=-1))
+                    correction = (row_max - new_max).exp()
+                    attn = (sim - new_max.unsqueeze(-1)).exp_()
+                    row_sum = row_sum * correction + attn.sum(dim=-1)
+                    row_max = new_max
+
+                    # dropout of the unnormalised weights is the dropout of the normalised ones
+                    attn = self.attn_dropout(attn)
+                    acc = acc * correction.unsqueeze(-1) + (attn.to(vb.dtype) @ vb).float()
+
+                out[h:h + head_block, s:s + query_block] = acc / row_sum.unsqueeze(-1)
+
+        return out.reshape(*batch_shape, i, -1)
+
     def forward(self, q, k, v):
-        if self.flash:
+        backend = default(self.backend, "sdpa" if self.flash else "math")
+        if backend == "sdpa":
             return self.flash_attn(q, k, v)
+        if backend == "chunked":
+            return self.chunked_attn(q, k, v)
 
         scale = q.shape[-1] ** -0.5
 
@@ -151,7 +282,7 @@ class Attend(nn.Module):
         sim = einsum("b h i d, b h j d -> b h i j", q, k) * scale
 
         # attention
-        attn = sim.softmax(dim=-1)
+        attn = sim.float().softmax(dim=-1).to(sim.dtype)
         attn = self.attn_dropout(attn)
 
         # aggregate values
@@ -188,6 +319,38 @@ def null_iterator():
     while True:
         yield None
 
+
+def is_channels_last(x: Tensor) -> bool:
+    # unambiguously channels_last, a (b, c, 1, 1) or (b, 1, h, w) tensor is both
+    return x.is_contiguous(memory_format=torch.channels_last) and not x.is_contiguous()
+
+
+def tokens_to_fmap(tokens: Tensor, pattern: str, channels: str, h: int, w: int, channels_last: bool = False) -> Tensor:
+    # attention output -> (b, c, h, w) feature map, laid out as channels_last if asked so: the
+    # copy rearrange makes anyway then writes NHWC directly, no conversion before the next conv
+    if channels_last:
+        return rearrange(tokens, f"{pattern} -> b x y ({channels})", x=h, y=w).permute(0, 3, 1, 2)
+    return rearrange(tokens, f"{pattern} -> b ({channels}) x y", x=h, y=w)
+
+
+def style_noise(seed: int, dim_in: int) -> Tensor:
+    # the (1, dim_in) style noise of a fixed style seed
+    generator = torch.Generator().manual_seed(seed)
+    return torch.randn((1, dim_in), generator=generator)
+
+
+def noise_augment(x: Tensor, style_seed: Optional[int] = None) -> Tensor:
+    # the small input noise augmentation the model expects, reproducible with a style seed: every
+    # tile then gets the same noise, so a tile's output does not depend on its place in the batch
+    noise_scale = 0.001  # Adjust the scale of the noise as needed
+    if exists(style_seed):
+        generator = torch.Generator().manual_seed(style_seed)
+        noise_aug = torch.randn((1, *x.shape[1:]), generator=generator).to(x.device, x.dtype) * noise_scale
+    else:
+        noise_aug = torch.randn_like(x) * noise_scale
+    x = x + noise_aug
+    return x.clamp(0, 1)
+
 def Downsample(dim, dim_out=None):
     return nn.Sequential(
         Rearrange("b c (h p1) (w p2) -> b (c p1 p2) h w", p1=2, p2=2),
@@ -202,7 +365,7 @@ class RMSNorm(nn.Module):
         self.eps = 1e-4
 
     def forward(self, x):
-        return F.normalize(x, dim=1) * self.g * (x.shape[1] ** 0.5)
+        return F.normalize(x.float(), dim=1).to(x.dtype) * self.g * (x.shape[1] ** 0.5)
 
 
 # building block modules
@@ -257,13 +420,29 @@ class LinearAttention(nn.Module):
         self.scale = dim_head**-0.5
         self.heads = heads
         hidden_dim = dim_head * heads
+        self.hidden_dim = hidden_dim
 
         self.norm = RMSNorm(dim)
         self.to_qkv = nn.Conv2d(dim, hidden_dim * 3, 1, bias=False)
 
         self.to_out = nn.Sequential(nn.Conv2d(hidden_dim, dim, 1), RMSNorm(dim))
 
+        # 'chunked' runs the tiles in blocks (see ATTENTION_CHUNK_SIZE), 'sdpa' and 'math' all at once
+        self.backend = None
+
     def forward(self, x):
+        if self.backend == "chunked":
+            b, c, h, w = x.shape
+            tiles = max(1, ATTENTION_CHUNK_SIZE // (3 * self.hidden_dim * h * w))
+            if tiles < b:
+                memory_format = torch.channels_last if is_channels_last(x) else torch.contiguous_format
+                out = torch.empty((b, self.hidden_dim, h, w), dtype=x.dtype, device=x.device, memory_format=memory_format)
+                for start in range(0, b, tiles):
+                    out[start:start + tiles] = self.attend(x[start:start + tiles])
+                return self.to_out(out)
+        return self.to_out(self.attend(x))
+
+    def attend(self, x):
         b, c, h, w = x.shape
 
         x = self.norm(x)
@@ -273,16 +452,15 @@ class LinearAttention(nn.Module):
             lambda t: rearrange(t, "b (h c) x y -> b h c (x y)", h=self.heads), qkv
         )
 
-        q = q.softmax(dim=-2)
-        k = k.softmax(dim=-1)
+        q = q.float().softmax(dim=-2).to(v.dtype)
+        k = k.float().softmax(dim=-1).to(v.dtype)
 
         q = q * self.scale
 
         context = torch.einsum("b h d n, b h e n -> b h d e", k, v)
 
         out = torch.einsum("b h d e, b h d n -> b h e n", context, q)
-        out = rearrange(out, "b h c (x y) -> b (h c) x y", h=self.heads, x=h, y=w)
-        return self.to_out(out)
+        return tokens_to_fmap(out, "b h c (x y)", "h c", h, w, channels_last=is_channels_last(x))
 
 
 class Attention(nn.Module):
@@ -307,7 +485,7 @@ class Attention(nn.Module):
         )
 
         out = self.attend(q, k, v)
-        out = rearrange(out, "b h (x y) d -> b (h d) x y", x=h, y=w)
+        out = tokens_to_fmap(out, "b h (x y) d", "h d", h, w, channels_last=is_channels_last(x))
 
         return self.to_out(out)
 
@@ -379,7 +557,7 @@ class NearestNeighborhoodUpsample(nn.Module):
 
     def forward(self, x):
 
-        if x.shape[0] >= 64:
+        if x.shape[0] >= 64 and not is_channels_last(x):
             x = x.contiguous()
 
         x = F.interpolate(x, scale_factor=2.0, mode="nearest")
@@ -609,6 +787,14 @@ class UnetUpsampler(torch.nn.Module):
         )
         self.style_embed_split_dims = style_embed_split_dims
 
+        # seed -> baked kernels of every AdaptiveConv2DMod, valid for style_cache_key (device, dtype, memory format)
+        # only the last seed is kept: the kernels take about as much memory as the model's weights
+        self.style_cache = {}
+        self.style_cache_key = None
+
+        # torch.channels_last keeps every feature map NHWC from the input tile on, see set_memory_format
+        self.memory_format = torch.contiguous_format
+
     @property
     def allowable_rgb_resolutions(self):
         input_res_base = int(log2(self.input_image_size))
@@ -620,6 +806,10 @@ class UnetUpsampler(torch.nn.Module):
     def device(self):
         return next(self.parameters()).device
 
+    @property
+    def dtype(self):
+        return next(self.parameters()).dtype
+
     @property
     def total_params(self):
         return sum([p.numel() for p in self.parameters()])
@@ -627,6 +817,81 @@ class UnetUpsampler(torch.nn.Module):
     def resize_image_to(self, x, size):
         return F.interpolate(x, (size, size), mode=self.resize_mode)
 
+    def modulated_convs(self):
+        # in the order forward() consumes the conv modulations
+        resnet_blocks = [block for blocks, _ in self.downs for block in blocks]
+        resnet_blocks += [self.mid_block1, self.mid_block2]
+        resnet_blocks += [block for blocks, _ in self.ups for block in blocks]
+        resnet_blocks.append(self.final_res_block)
+
+        for resnet_block in resnet_blocks:
+            yield resnet_block.block1.proj
+            yield resnet_block.block2.proj
+
+    def clear_style_cache(self):
+        self.style_cache.clear()
+        self.style_cache_key = None
+
+    def load_state_dict(self, *args, **kwargs):
+        self.clear_style_cache()
+        return super().load_state_dict(*args, **kwargs)
+
+    def _apply(self, *args, **kwargs):
+        # moves and casts (.to, .cpu, .half...) leave the baked kernels behind, drop them rather than
+        # keep them on the device the model was moved off
+        self.clear_style_cache()
+        return super()._apply(*args, **kwargs)
+
+    @torch.no_grad()
+    def fixed_style_weights(self, seed: int) -> List[Tensor]:
+        key = (self.device, self.dtype, self.memory_format)
+        if self.style_cache_key != key:
+            self.clear_style_cache()
+            self.style_cache_key = key
+
+        if seed not in self.style_cache:
+            self.style_cache.clear()
+            noise = style_noise(seed, self.style_network.dim_in)
+            styles = self.style_network(noise.to(self.device, self.dtype))
+
+            conv_mods = self.style_to_conv_modulations(styles)
+            conv_mods = iter(conv_mods.split(self.style_embed_split_dims, dim=-1))
+
+            self.style_cache[seed] = [
+                conv.modulate_weights(next(conv_mods), next(conv_mods))[0].contiguous(memory_format=self.memory_format)
+                for conv in self.modulated_convs()
+            ]
+
+        return self.style_cache[seed]
+
+    def set_conv_mode(self, conv_mode: str):
+        assert conv_mode in CONV_MODES, f"conv_mode must be one of {CONV_MODES}"
+        for module in self.modules():
+            if isinstance(module, AdaptiveConv2DMod):
+                module.conv_mode = conv_mode
+
+    def set_attention_backend(self, backend: Optional[str] = None):
+        # None restores each layer's own: 'sdpa' for the full attention layers built with flash_attn
+        assert backend is None or backend in ATTENTION_BACKENDS, f"backend must be one of {ATTENTION_BACKENDS}"
+        for module in self.modules():
+            if isinstance(module, (Attend, LinearAttention)):
+                module.backend = backend
+
+    def set_memory_format(self, memory_format: torch.memory_format):
+        """
+        torch.channels_last runs the whole network NHWC: the conv weights are converted once,
+        the input tile on entry, and every layer keeps that layout (the attention outputs are
+        written NHWC, the skip concatenations and the modulated convs preserve it). Only the
+        'activation' conv mode is layout preserving, the 'weight' mode folds the batch into the
+        channels of a grouped conv, so the caller has to switch to it (AuraSR does).
+        """
+        assert memory_format in (torch.contiguous_format, torch.channels_last)
+        for module in self.modules():
+            if isinstance(module, nn.Conv2d):
+                module.weight.data = module.weight.data.contiguous(memory_format=memory_format)
+        self.memory_format = memory_format
+        self.clear_style_cache()
+
     def forward(
         self,
         lowres_image: torch.Tensor,
@@ -634,13 +899,18 @@ class UnetUpsampler(torch.nn.Module):
         noise: Optional[torch.Tensor] = None,
         global_text_tokens: Optional[torch.Tensor] = None,
         return_all_rgbs: bool = False,
+        style_seed: Optional[int] = None,
+        unet: Optional[Callable] = None,
     ):
         x = lowres_image
 
-        noise_scale = 0.001  # Adjust the scale of the noise as needed
-        noise_aug = torch.randn_like(x) * noise_scale
-        x = x + noise_aug
-        x = x.clamp(0, 1)
+        # a fixed style seed swaps the style network for cached, pre-modulated kernels
+        # and makes the noise augmentation reproducible as well
+        baked_weights = self.fixed_style_weights(style_seed) if exists(style_seed) else None
+        for conv, weights in zip(self.modulated_convs(), default(baked_weights, null_iterator())):
+            conv.baked_weights = weights
+
+        x = noise_augment(x, style_seed)
 
         shape = x.shape
         batch_size = shape[0]
@@ -648,22 +918,38 @@ class UnetUpsampler(torch.nn.Module):
         assert shape[-2:] == ((self.input_image_size,) * 2)
 
         # styles
-        if not exists(styles):
+        if not exists(baked_weights) and not exists(styles):
             assert exists(self.style_network)
 
             noise = default(
                 noise,
                 torch.randn(
-                    (batch_size, self.style_network.dim_in), device=self.device
+                    (batch_size, self.style_network.dim_in), device=self.device, dtype=self.dtype
                 ),
             )
             styles = self.style_network(noise, global_text_tokens)
 
         # project styles to conv modulations
-        conv_mods = self.style_to_conv_modulations(styles)
-        conv_mods = conv_mods.split(self.style_embed_split_dims, dim=-1)
-        conv_mods = iter(conv_mods)
+        conv_mods = None
+        if not exists(baked_weights):
+            conv_mods = self.style_to_conv_modulations(styles)
+            conv_mods = conv_mods.split(self.style_embed_split_dims, dim=-1)
+
+        # unet: a compiled version of self.unet, see AuraSR.compile
+        rgb = (unet or self.unet)(x, conv_mods)
+
+        if not return_all_rgbs:
+            return rgb
+
+        return rgb, []
 
+    def unet(self, x: Tensor, conv_mods: Optional[Tuple[Tensor, ...]] = None) -> Tensor:
+        # the network proper: everything after the style is prepared, without any python side
+        # effects, so that AuraSR can compile it. conv_mods are the per-conv modulations in the
+        # order of modulated_convs(), None when the convs hold baked weights
+        conv_mods = iter(conv_mods) if exists(conv_mods) else null_iterator()
+
+        x = x.contiguous(memory_format=self.memory_format)
         x = self.init_conv(x)
 
         h = []
@@ -701,24 +987,162 @@ class UnetUpsampler(torch.nn.Module):
                 x = attn(x)
 
         x = self.final_res_block(x, conv_mods_iter=conv_mods)
-        rgb = self.final_to_rgb(x)
+        return self.final_to_rgb(x)
 
-        if not return_all_rgbs:
-            return rgb
 
-        return rgb, []
+def tile_view(image: Tensor, tile_size: int) -> Tensor:
+    # (c, h, w) -> (h_chunks, w_chunks, c, tile_size, tile_size) strided view, nothing is copied
+    return image.unfold(1, tile_size, tile_size).unfold(2, tile_size, tile_size).permute(1, 2, 0, 3, 4)
+
+
+class TileGrid:
+    """
+    A padded (c, h, w) image seen as a grid of square tiles, together with the preallocated
+    (c, h * scale, w * scale) output the upscaled tiles are written into.
+
+    Tiles are addressed by their flat row-major index. A batch is gathered from the input
+    view and written back into the output view with one indexed assignment each.
+    """
+
+    def __init__(self, image: Tensor, tile_size: int, scale: int = 4, output: Optional[Tensor] = None, blend: Optional[Tensor] = None):
+        c, h, w = image.shape
+        assert h % tile_size == 0 and w % tile_size == 0, "image must be padded to a multiple of the tile size"
+
+        self.tile_size = tile_size
+        self.h_chunks = h // tile_size
+        self.w_chunks = w // tile_size
+
+        # with a (tile_size * scale)^2 blend map the tiles are weighted and accumulated into output
+        # (which can be a view shared with other grids) instead of being assigned
+        self.blend = blend
+        self.tiles = tile_view(image, tile_size)
+        self.output = default(output, lambda: torch.empty((c, h * scale, w * scale), dtype=torch.float32))
+        self.output_tiles = tile_view(self.output, tile_size * scale)
+
+        # tiles left to run, on_done(grid) is called once the last of them has been scattered
+        self.select(torch.arange(len(self)))
+        self.on_done = None
+
+    def __len__(self):
+        return self.h_chunks * self.w_chunks
 
+    def select(self, indices: Tensor):
+        self.indices = indices
+        self.remaining = len(indices)
+
+    def positions(self, indices: Tensor):
+        return indices // self.w_chunks, indices % self.w_chunks
+
+    def done(self):
+        if exists(self.on_done):
+            self.on_done(self)
+
+    def prepare(self):
+        # called right before the grid is scheduled, after every earlier pass of its job is complete
+        pass
+
+    def gather(self, indices: Tensor) -> Tensor:
+        rows, cols = self.positions(indices)
+        return self.tiles[rows, cols]
+
+    def scatter(self, indices: Tensor, tiles: Tensor):
+        self.write(indices, tiles.to(self.output.dtype))
+
+        self.remaining -= len(indices)
+        if self.remaining == 0:
+            self.done()
+
+    def write(self, indices: Tensor, tiles: Tensor):
+        rows, cols = self.positions(indices)
+
+        if exists(self.blend):
+            self.output_tiles.index_put_((rows, cols), tiles * self.blend, accumulate=True)
+        else:
+            self.output_tiles[rows, cols] = tiles
+
+
+class SeamGrid(TileGrid):
+    """
+    The half-tile offset grid of the seam refinement mode, over a canvas that already holds
+    the base pass. Offset tile (r, c) is centred on corner (r, c) of the base grid, so it
+    straddles a horizontal seam for 0 < r < h_chunks - 1 and a vertical one for
+    0 < c < w_chunks - 1.
+
+    Only those tiles are run. A seam_threshold above 0 (the default, 0, runs all of them)
+    further skips the tiles whose seams look invisible in the base result: the step across the
+    seam, relative to the steps right next to it, summed over the whole tile width, must exceed
+    it. A seam visible along only part of a tile can score below it and keep the base pass.
+    The run tiles are feathered into the base result over a band of seam_overlap output
+    pixels around the seams they cover, everything else keeps the base pass.
+    """
+
+    def __init__(self, image: Tensor, tile_size: int, output: Tensor, seam_overlap=64, seam_threshold=0.0, scale: int = 4):
+        super().__init__(image, tile_size, scale, output=output)
+        self.seam_threshold = seam_threshold
+        self.seam_weights = create_seam_weights(tile_size * scale, seam_overlap)
+
+        rows, cols = self.positions(torch.arange(len(self)))
+        self.has_h = (rows > 0) & (rows < self.h_chunks - 1)
+        self.has_v = (cols > 0) & (cols < self.w_chunks - 1)
+
+        # candidates, narrowed down to the visible seams by prepare() once the base pass is in
+        self.select(torch.nonzero(self.has_h | self.has_v).flatten())
+
+    def seam_scores(self, indices: Tensor) -> Tensor:
+        rows, cols = self.positions(indices)
+        mid = self.output_tiles.shape[-1] // 2
+
+        def score(x):
+            # x: (n, c, 4, t), the seam runs between the middle two rows
+            step = (x[:, :, 2] - x[:, :, 1]).abs().sum(dim=(1, 2))
+            near = (x[:, :, 1] - x[:, :, 0]).abs().sum(dim=(1, 2)) + (x[:, :, 3] - x[:, :, 2]).abs().sum(dim=(1, 2))
+            return step / (near / 2 + 1e-6)
+
+        # only the four rows/columns around the seams are gathered
+        across_h = self.output_tiles[..., mid - 2:mid + 2, :][rows, cols]
+        across_v = self.output_tiles[..., mid - 2:mid + 2][rows, cols].transpose(-1, -2)
+
+        return torch.maximum(score(across_h) * self.has_h[indices], score(across_v) * self.has_v[indices])
+
+    def prepare(self):
+        if self.seam_threshold > 0 and len(self.indices) > 0:
+            indices = self.indices
+            self.select(indices[self.seam_scores(indices) > self.seam_threshold])
+
+    def write(self, indices: Tensor, tiles: Tensor):
+        rows, cols = self.positions(indices)
+        kinds = self.has_h[indices].long() + 2 * self.has_v[indices].long()
+        weights = self.seam_weights[kinds].unsqueeze(1)
+
+        self.output_tiles[rows, cols] = self.output_tiles[rows, cols].lerp_(tiles, weights)
+
+
+class UpscaleJob:
+    """
+    The grids of one image, in passes: each pass only starts once the previous one is
+    complete. finish(job) runs once every grid is complete, from whichever thread
+    completed the last one.
+    """
+
+    def __init__(self, passes: List[List[TileGrid]], finish):
+        self.passes = passes
+        self.grids = [grid for grids in passes for grid in grids]
+        self.finish = finish
+        self.result = None
+        self.pending = len(self.grids)
+        self.lock = threading.Lock()
+
+        for grid in self.grids:
+            grid.on_done = self.grid_done
+
+    def grid_done(self, grid: TileGrid):
+        with self.lock:
+            self.pending -= 1
+            finished = self.pending == 0
+
+        if finished:
+            self.finish(self)
 
-def tile_image(image, chunk_size=64):
-    c, h, w = image.shape
-    h_chunks = ceil(h / chunk_size)
-    w_chunks = ceil(w / chunk_size)
-    tiles = []
-    for i in range(h_chunks):
-        for j in range(w_chunks):
-            tile = image[:, i * chunk_size:(i + 1) * chunk_size, j * chunk_size:(j + 1) * chunk_size]
-            tiles.append(tile)
-    return tiles, h_chunks, w_chunks
 
 # This helps create a checkboard pattern with some edge blending
 def create_checkerboard_weights(tile_size):
@@ -735,44 +1159,133 @@ def create_checkerboard_weights(tile_size):
 
     return weights / weights.max()  # Normalize to [0, 1]
 
-def repeat_weights(weights, image_size):
-    tile_size = weights.shape[0]
-    repeats = (math.ceil(image_size[0] / tile_size), math.ceil(image_size[1] / tile_size))
-    return weights.repeat(repeats)[:image_size[0], :image_size[1]]
-
-def create_offset_weights(weights, image_size):
-    tile_size = weights.shape[0]
-    offset = tile_size // 2
-    full_weights = repeat_weights(weights, (image_size[0] + offset, image_size[1] + offset))
-    return full_weights[offset:, offset:]
-
-def merge_tiles(tiles, h_chunks, w_chunks, chunk_size=64):
-    # Determine the shape of the output tensor
-    c = tiles[0].shape[0]
-    h = h_chunks * chunk_size
-    w = w_chunks * chunk_size
-
-    # Create an empty tensor to hold the merged image
-    merged = torch.zeros((c, h, w), dtype=tiles[0].dtype)
-
-    # Iterate over the tiles and place them in the correct position
-    for idx, tile in enumerate(tiles):
-        i = idx // w_chunks
-        j = idx % w_chunks
-
-        h_start = i * chunk_size
-        w_start = j * chunk_size
-
-        tile_h, tile_w = tile.shape[1:]
-        merged[:, h_start:h_start+tile_h, w_start:w_start+tile_w] = tile
-
-    return merged
+@lru_cache(maxsize=8)
+def create_blend_weights(tile_size, weight_type='checkboard'):
+    # The normalised per-pixel weight of a tile of either pass in the overlapped modes.
+    # Both repeated weight maps have a period of tile_size over an image padded to whole
+    # tiles and the passes are half a tile apart, so the normaliser is the same for every
+    # tile of both passes: one (tile_size, tile_size) map serves any image size.
+    if weight_type == 'checkboard':
+        weights = create_checkerboard_weights(tile_size)
+        offset = tile_size // 2
+        return weights / (weights + torch.roll(weights, (offset, offset), dims=(0, 1)))
+    if weight_type == 'constant':
+        return torch.full((tile_size, tile_size), 0.5)
+    raise ValueError("weight_type should be either 'checkboard' or 'constant' but got", weight_type)
+
+@lru_cache(maxsize=8)
+def create_seam_weights(tile_size, seam_overlap):
+    # Feathering weights of a seam refinement tile, centred on a base grid corner: a linear
+    # ramp from 1 on the seam to 0 at seam_overlap / 2 from it. Indexed by which seams the
+    # tile covers, 1 - horizontal, 2 - vertical, 3 - both (0 - none).
+    distance = (torch.arange(tile_size) + 0.5 - tile_size / 2).abs()
+    ramp = (1 - distance / max(seam_overlap / 2, 1)).clamp(min=0)
+
+    horizontal = ramp[:, None].expand(tile_size, tile_size)
+    vertical = ramp[None, :].expand(tile_size, tile_size)
+    return torch.stack((torch.zeros_like(horizontal), horizontal, vertical, torch.maximum(horizontal, vertical)))
+
+@torch.no_grad()
+def load_upsampler(config: dict[str, Any], checkpoint_path, device="cuda", dtype: torch.dtype = torch.float32) -> UnetUpsampler:
+    """
+    Builds a UnetUpsampler on the meta device (no memory, none of the random initialisation) and
+    assigns it the tensors of a memory-mapped safetensors checkpoint, read one at a time straight
+    onto the target device and cast to dtype there. Host memory only ever holds the tensor being
+    read on accelerators, the model once on the CPU.
+    """
+    from safetensors import safe_open
+
+    with torch.device("meta"):
+        upsampler = UnetUpsampler(**config)
+
+    device = torch.device(device)
+    try:
+        checkpoint = safe_open(str(checkpoint_path), framework="pt", device=str(device))
+    except Exception:  # devices safetensors cannot read to, go through the CPU
+        checkpoint = safe_open(str(checkpoint_path), framework="pt", device="cpu")
+
+    state_dict = {}
+    with checkpoint:
+        for name in checkpoint.keys():
+            state_dict[name] = checkpoint.get_tensor(name).to(device, dtype)
+
+    upsampler.load_state_dict(state_dict, strict=True, assign=True)
+    if any(t.is_meta for t in chain(upsampler.parameters(), upsampler.buffers())):
+        raise RuntimeError("the checkpoint did not initialise every tensor of the model")
+    return upsampler
+
+
+def pil_to_tensor(image: Image.Image) -> Tensor:
+    # (c, h, w) float in [0, 1], as torchvision's ToTensor
+    array = np.atleast_3d(np.array(image, dtype=np.uint8))
+    return torch.from_numpy(array).permute(2, 0, 1).float().div(255)
+
+
+def tensor_to_pil(image: Tensor) -> Image.Image:
+    # as torchvision's ToPILImage on a (c, h, w) float tensor
+    array = image.mul(255).byte().permute(1, 2, 0).cpu().numpy()
+    return Image.fromarray(array[..., 0] if array.shape[-1] == 1 else array)
+
+
+def rgb_images(images: Tensor) -> Tensor:
+    # (b, h, w, c) float batch with 1, 3 or 4 channels -> (b, h, w, 3)
+    images = images.float()
+    if images.shape[-1] == 1:
+        images = images.expand(-1, -1, -1, 3)
+    return images[..., :3]
 
 class AuraSR:
-    def __init__(self, config: dict[str, Any], device: str = "cuda"):
-        self.upsampler = UnetUpsampler(**config).to(device)
+    # the engine running the model, see onnx_engine.OnnxAuraSR for the other one
+    engine = "torch"
+
+    # profiling.Profiler timing the stages of the current run, set by the nodes when profiling is on
+    profiler = None
+
+    # tile_cache.TileCache of the outputs of this model, see set_tile_cache
+    tile_cache = None
+
+    def __init__(self, config: dict[str, Any], device: str = "cuda", conv_mode: str = "weight", pipelined: Optional[bool] = None, precision: str = "fp32", upsampler: Optional[UnetUpsampler] = None):
+        # upsampler: an already loaded model, on its device and at the dtype of precision (see from_checkpoint)
+        assert precision in PRECISIONS, f"precision must be one of {tuple(PRECISIONS)}"
+        self.upsampler = upsampler if upsampler is not None else UnetUpsampler(**config).to(device, PRECISIONS[precision])
+        self.upsampler.set_conv_mode(conv_mode)
+        self.init_state(config, precision, conv_mode, pipelined)
+
+    def init_state(self, config: dict[str, Any], precision: str, conv_mode: Optional[str], pipelined: Optional[bool]):
+        # the run options and caches, shared with the other engines (see onnx_engine.OnnxAuraSR)
+        self.conv_mode = conv_mode
+        self.channels_last = False
+        self.attention_backend = None
+        self.precision = precision
+        self.quantized = False
+        self.config = config
+
+        # (batch size, style mode, dtype, device, channels_last, attention backend) -> compiled UnetUpsampler.unet,
+        # see compile(). A failed compile is not tried again for as long as the model is loaded
+        self.compiled = False
+        self.compile_failed = False
+        self.compiled_unets = {}
         self.input_image_size = config["input_image_size"]
 
+        # None pipelines the tile scheduler only on accelerators, see TileScheduler
+        self.pipelined = pipelined
+        self.last_schedule_report = None
+
+    @classmethod
+    def from_checkpoint(cls, config: dict[str, Any], checkpoint_path, device: str = "cuda", precision: str = "fp32", **kwargs) -> "AuraSR":
+        # fast path for .safetensors checkpoints, see load_upsampler. Falls back to building the model
+        # normally and loading the whole checkpoint into it
+        assert precision in PRECISIONS, f"precision must be one of {tuple(PRECISIONS)}"
+        try:
+            upsampler = load_upsampler(config, checkpoint_path, device, PRECISIONS[precision])
+        except Exception as e:
+            print(f"[AuraSR-ComfyUI] Fast loading failed ({str(e).splitlines()[0]}), loading the checkpoint normally.")
+            from safetensors.torch import load_file
+            aura_sr = cls(config, device=device, precision=precision, **kwargs)
+            aura_sr.upsampler.load_state_dict(load_file(str(checkpoint_path)), strict=True)
+            return aura_sr
+        return cls(config, device=device, precision=precision, upsampler=upsampler, **kwargs)
+
     ## Disabled from_pretrained because it imports huggingface_hub and its never really used by the Node
     #@classmethod
     #def from_pretrained(cls, model_id: str = "fal-ai/AuraSR", use_safetensors: bool = True):
@@ -826,131 +1339,367 @@ class AuraSR:
     #    model.upsampler.load_state_dict(checkpoint, strict=True)
     #    return model
 
-    @torch.no_grad()
-    def upscale_4x(self, image: Image.Image, max_batch_size=8) -> Image.Image:
-        tensor_transform = transforms.ToTensor()
-        device = self.upsampler.device
+    @property
+    def device(self) -> torch.device:
+        return self.upsampler.device
 
-        image_tensor = tensor_transform(image).unsqueeze(0)
-        _, _, h, w = image_tensor.shape
+    @property
+    def dtype(self) -> torch.dtype:
+        return self.upsampler.dtype
+
+    def set_channels_last(self, enabled: bool = True):
+        # NHWC execution, for oneDNN/cuDNN's channels_last kernels. Needs the 'activation'
+        # conv mode, the conv mode given to __init__ is restored when it is turned off again
+        if enabled == self.channels_last:
+            return self
+        self.upsampler.set_memory_format(torch.channels_last if enabled else torch.contiguous_format)
+        self.upsampler.set_conv_mode("activation" if enabled else self.conv_mode)
+        self.channels_last = enabled
+        return self
+
+    def set_attention_backend(self, backend: Optional[str] = None):
+        # one of ATTENTION_BACKENDS for every attention layer, None goes back to the config's (flash_attn)
+        if backend != self.attention_backend:
+            self.upsampler.set_attention_backend(backend)
+            self.attention_backend = backend
+        return self
+
+    def profile(self, name: str):
+        # times a stage of the run with the profiler, a no-op without one
+        return self.profiler.stage(name) if self.profiler is not None else nullcontext()
+
+    def quantize(self):
+        # switches to the int8 CPU engine, see quantization.quantize_upsampler
+        if not self.quantized:
+            from .quantization import quantize_upsampler
+            quantize_upsampler(self.upsampler)
+            self.quantized = True
+        return self
+
+    def compile(self, enabled: bool = True):
+        """
+        Opt-in compiled execution: UnetUpsampler.unet (the whole network after the style is
+        prepared) runs through torch.compile, once per (batch size, dtype, device) and style mode:
+        a fixed style (baked kernels) and random styles (per tile modulations) trace different
+        graphs. The graphs stay cached on this object for as long as the model is loaded, and
+        partial batches are padded up to the scheduler's batch size so they never trigger a
+        recompile.
+        """
+        if enabled and self.compile_failed:
+            print("[AuraSR-ComfyUI] Compiling failed earlier for this model, running eagerly.")
+        self.compiled = enabled and not self.compile_failed
+        return self
+
+    def compiled_unet(self, batch_size: int, style_seed: Optional[int] = None) -> Callable:
+        style_mode = "fixed" if exists(style_seed) else "random"
+        key = (batch_size, style_mode, self.dtype, self.device, self.channels_last, self.attention_backend)
+        if key not in self.compiled_unets:
+            self.compiled_unets[key] = torch.compile(self.upsampler.unet, dynamic=False)
+        return self.compiled_unets[key]
+
+    def infer(self, model_input: Tensor, style_seed: Optional[int] = None, batch_size: Optional[int] = None) -> Tensor:
+        model_input = model_input.to(self.dtype)
+
+        if self.compiled:
+            try:
+                return self.infer_compiled(model_input, style_seed, batch_size)
+            except Exception as e:
+                print(f"[AuraSR-ComfyUI] Compiled mode failed ({type(e).__name__}: {e}). Running eagerly from now on.")
+                self.compiled = False
+                self.compile_failed = True
+
+        return self.infer_eager(model_input, style_seed)
+
+    def infer_eager(self, model_input: Tensor, style_seed: Optional[int] = None, unet: Optional[Callable] = None) -> Tensor:
+        # a style_seed runs every tile with the same cached, pre-modulated style
+        if exists(style_seed):
+            return self.upsampler(lowres_image=model_input, style_seed=style_seed, unet=unet)
+
+        noise = torch.randn(model_input.shape[0], self.upsampler.style_network.dim_in, device=model_input.device, dtype=model_input.dtype)
+        return self.upsampler(lowres_image=model_input, noise=noise, unet=unet)
+
+    def infer_compiled(self, model_input: Tensor, style_seed: Optional[int] = None, batch_size: Optional[int] = None) -> Tensor:
+        # pads the batch up to batch_size, the padding tiles are dropped from the output
+        b = model_input.shape[0]
+        batch_size = max(b, default(batch_size, b))
+        if b < batch_size:
+            model_input = torch.cat((model_input, model_input.new_zeros((batch_size - b, *model_input.shape[1:]))))
+
+        return self.infer_eager(model_input, style_seed, unet=self.compiled_unet(batch_size, style_seed))[:b]
+
+    def pad_to_tiles(self, image_tensor: Tensor) -> Tensor:
+        # reflect-pad a (c, h, w) image up to a multiple of the tile size
+        _, h, w = image_tensor.shape
         pad_h = (self.input_image_size - h % self.input_image_size) % self.input_image_size
         pad_w = (self.input_image_size - w % self.input_image_size) % self.input_image_size
+        return F.pad(image_tensor.unsqueeze(0), (0, pad_w, 0, pad_h), mode='reflect').squeeze(0)
+
+    def set_tile_cache(self, capacity_mb: float = 0):
+        """
+        Keeps the outputs of up to capacity_mb of upscaled tiles, reused for identical input tiles in
+        the same image or later ones (see tile_cache.TileCache). Only runs with a fixed style seed use
+        it, the random styles make every output different. 0 drops the cache.
+        """
+        from .tile_cache import TileCache
 
-        # Pad the image
-        image_tensor = torch.nn.functional.pad(image_tensor, (0, pad_w, 0, pad_h), mode='reflect').squeeze(0)
-        tiles, h_chunks, w_chunks = tile_image(image_tensor, self.input_image_size)
+        capacity = int(capacity_mb * (1 << 20))
+        if capacity <= 0:
+            self.tile_cache = None
+        elif self.tile_cache is None:
+            self.tile_cache = TileCache(capacity)
+        else:
+            self.tile_cache.resize(capacity)
+        return self
+
+    def tile_cache_namespace(self, style_seed: int) -> bytes:
+        # everything besides the input tile a cached output depends on
+        options = (self.engine, str(self.dtype), self.quantized, self.conv_mode, self.channels_last, self.attention_backend, self.input_image_size, style_seed)
+        return repr(options).encode()
+
+    def make_scheduler(self, max_batch_size=8, style_seed: Optional[int] = None) -> TileScheduler:
+        cache = self.tile_cache if exists(style_seed) else None
+        return TileScheduler(
+            lambda tiles: self.infer(tiles, style_seed, max_batch_size).clamp_(0, 1),
+            self.device,
+            max_batch_size=max_batch_size,
+            pipelined=self.pipelined,
+            dtype=self.dtype,
+            cache=cache,
+            cache_namespace=self.tile_cache_namespace(style_seed) if exists(cache) else b"",
+        )
 
-        # Batch processing of tiles
-        num_tiles = len(tiles)
-        batches = [tiles[i:i + max_batch_size] for i in range(0, num_tiles, max_batch_size)]
-        reconstructed_tiles = []
+    def make_job(self, image_tensor: Tensor, mode: str, out: Optional[Tensor] = None, seam_overlap=64, seam_threshold=0.0) -> UpscaleJob:
+        # padding and splitting into tile grids
+        with self.profile("tiling"):
+            assert mode in UPSCALE_MODES, f"mode must be one of {UPSCALE_MODES}"
+            _, h, w = image_tensor.shape
 
-        for batch in batches:
-            model_input = torch.stack(batch).to(device)
-            generator_output = self.upsampler(
-                lowres_image=model_input,
-                noise=torch.randn(model_input.shape[0], 128, device=device)
-            )
-            reconstructed_tiles.extend(list(generator_output.clamp_(0, 1).detach().cpu()))
+            # Pad the image
+            image_tensor = self.pad_to_tiles(image_tensor)
+
+            if mode == "4x":
+                passes = [[TileGrid(image_tensor, self.input_image_size)]]
+                result = passes[0][0].output[:, :h * 4, :w * 4]
+            else:
+                # Tiled 4x upscaling with overlapping tiles to reduce seam artifacts: a second grid,
+                # offset by half a tile, writes into the same canvas as the base grid. The canvas has
+                # room for the offset grid, the base grid writes into its interior
+                offset = self.input_image_size // 2
+                offset_4x = offset * 4
+
+                image_tensor_offset = torch.nn.functional.pad(image_tensor, (offset, offset, offset, offset), mode='reflect')
+                _, ph, pw = image_tensor_offset.shape
+
+                canvas = torch.zeros((3, ph * 4, pw * 4), dtype=torch.float32)
+                interior = canvas[:, offset_4x:-offset_4x, offset_4x:-offset_4x]
+
+                if mode == "4x_overlapped_seams":
+                    # second pass only where the base pass left visible seams
+                    passes = [
+                        [TileGrid(image_tensor, self.input_image_size, output=interior)],
+                        [SeamGrid(image_tensor_offset, self.input_image_size, output=canvas, seam_overlap=seam_overlap, seam_threshold=seam_threshold)],
+                    ]
+                else:
+                    # both grids in the same batch stream, accumulating their blended tiles in place
+                    blend = create_blend_weights(self.input_image_size * 4, mode.rsplit("_", 1)[-1])
+                    passes = [[
+                        TileGrid(image_tensor, self.input_image_size, output=interior, blend=blend),
+                        TileGrid(image_tensor_offset, self.input_image_size, output=canvas, blend=blend),
+                    ]]
+
+                result = interior[:, :h * 4, :w * 4]
+
+        def finish(job):
+            if exists(out):
+                with self.profile("convert_output"):
+                    out.copy_(result.permute(1, 2, 0))
+            else:
+                job.result = result
+
+        return UpscaleJob(passes, finish)
+
+    def run_jobs(self, jobs: Iterable[UpscaleJob], scheduler: TileScheduler):
+        # single pass jobs stream through the scheduler lazily, a later pass needs
+        # the earlier ones complete, so multi-pass jobs are all run pass by pass
+        jobs = iter(jobs)
+        first = next(jobs, None)
+        if first is None:
+            return
+
+        jobs = [first, *jobs] if len(first.passes) > 1 else chain([first], jobs)
 
-        merged_tensor = merge_tiles(reconstructed_tiles, h_chunks, w_chunks, self.input_image_size * 4)
-        unpadded = merged_tensor[:, :h * 4, :w * 4]
+        def grids(i):
+            for job in jobs:
+                for grid in job.passes[i]:
+                    with self.profile("tiling"):
+                        grid.prepare()
+                    yield grid
 
-        to_pil = transforms.ToPILImage()
-        return to_pil(unpadded)
+        for i in range(len(first.passes)):
+            scheduler.run(grids(i))
+        self.last_schedule_report = scheduler.report()
+
+    @torch.no_grad()
+    def upscale_4x_tensor(self, image_tensor: Tensor, max_batch_size=8, style_seed: Optional[int] = None, scheduler: Optional[TileScheduler] = None) -> Tensor:
+        # (c, h, w) in [0, 1] -> (c, 4h, 4w)
+        job = self.make_job(image_tensor, "4x")
+        self.run_jobs([job], default(scheduler, lambda: self.make_scheduler(max_batch_size, style_seed)))
+        return job.result
 
     # Tiled 4x upscaling with overlapping tiles to reduce seam artifacts
     # weights options are 'checkboard' and 'constant'
     @torch.no_grad()
-    def upscale_4x_overlapped(self, image, max_batch_size=8, weight_type='checkboard'):
-        tensor_transform = transforms.ToTensor()
-        device = self.upsampler.device
-
-        image_tensor = tensor_transform(image).unsqueeze(0)
-        _, _, h, w = image_tensor.shape
-
-        # Calculate paddings
-        pad_h = (
-            self.input_image_size - h % self.input_image_size
-        ) % self.input_image_size
-        pad_w = (
-            self.input_image_size - w % self.input_image_size
-        ) % self.input_image_size
-
-        # Pad the image
-        image_tensor = torch.nn.functional.pad(
-            image_tensor, (0, pad_w, 0, pad_h), mode="reflect"
-        ).squeeze(0)
-
-        # Function to process tiles
-        def process_tiles(tiles, h_chunks, w_chunks):
-            num_tiles = len(tiles)
-            batches = [
-                tiles[i : i + max_batch_size]
-                for i in range(0, num_tiles, max_batch_size)
-            ]
-            reconstructed_tiles = []
+    def upscale_4x_overlapped_tensor(self, image_tensor: Tensor, max_batch_size=8, weight_type='checkboard', style_seed: Optional[int] = None, scheduler: Optional[TileScheduler] = None) -> Tensor:
+        # (c, h, w) in [0, 1] -> (c, 4h, 4w)
+        if weight_type not in ('checkboard', 'constant'):
+            raise ValueError("weight_type should be either 'checkboard' or 'constant' but got", weight_type)
 
-            for batch in batches:
-                model_input = torch.stack(batch).to(device)
-                generator_output = self.upsampler(
-                    lowres_image=model_input,
-                    noise=torch.randn(model_input.shape[0], 128, device=device),
-                )
-                reconstructed_tiles.extend(
-                    list(generator_output.clamp_(0, 1).detach().cpu())
-                )
+        job = self.make_job(image_tensor, f"4x_overlapped_{weight_type}")
+        self.run_jobs([job], default(scheduler, lambda: self.make_scheduler(max_batch_size, style_seed)))
+        return job.result
 
-            return merge_tiles(
-                reconstructed_tiles, h_chunks, w_chunks, self.input_image_size * 4
-            )
+    @torch.no_grad()
+    def upscale(self, images: Tensor, mode: str = "4x", max_batch_size=8, style_seed: Optional[int] = None, pool_tiles: bool = True, seam_overlap=64, seam_threshold=0.0, session=None) -> Tensor:
+        """
+        tensor in, tensor out: takes a ComfyUI style (b, h, w, c) float batch in [0, 1]
+        and returns the (b, 4h, 4w, 3) upscaled batch without going through PIL
 
-        # First pass
-        tiles1, h_chunks1, w_chunks1 = tile_image(image_tensor, self.input_image_size)
-        result1 = process_tiles(tiles1, h_chunks1, w_chunks1)
+        pool_tiles feeds the tiles of every image into one queue, so tile batches are filled
+        across image boundaries and only the very last one can be partial. Each image is
+        merged into the output as soon as its last tile is back.
 
-        # Second pass with offset
-        offset = self.input_image_size // 2
-        image_tensor_offset = torch.nn.functional.pad(image_tensor, (offset, offset, offset, offset), mode='reflect').squeeze(0)        
+        4x_overlapped_seams runs the half-tile offset pass only on the tiles that straddle
+        seams of the base pass and feathers them in over seam_overlap output pixels. A
+        seam_threshold above 0 skips the ones whose seam scores below it, see SeamGrid
 
-        tiles2, h_chunks2, w_chunks2 = tile_image(
-            image_tensor_offset, self.input_image_size
-        )
-        result2 = process_tiles(tiles2, h_chunks2, w_chunks2)
+        session (incremental.UpscaleSession) keeps this run to only run the tiles whose input
+        changed in the next one, needs a fixed style_seed
+        """
 
-        # unpad 
-        offset_4x = offset * 4
-        result2_interior = result2[:, offset_4x:-offset_4x, offset_4x:-offset_4x]
-
-        if weight_type == 'checkboard':
-            weight_tile = create_checkerboard_weights(self.input_image_size * 4)
-            
-            weight_shape = result2_interior.shape[1:]
-            weights_1 = create_offset_weights(weight_tile, weight_shape)
-            weights_2 = repeat_weights(weight_tile, weight_shape)
-            
-            normalizer = weights_1 + weights_2
-            weights_1 = weights_1 / normalizer
-            weights_2 = weights_2 / normalizer
-
-            weights_1 = weights_1.unsqueeze(0).repeat(3, 1, 1)
-            weights_2 = weights_2.unsqueeze(0).repeat(3, 1, 1)
-        elif weight_type == 'constant':
-            weights_1 = torch.ones_like(result2_interior) * 0.5
-            weights_2 = weights_1
+        assert mode in UPSCALE_MODES, f"mode must be one of {UPSCALE_MODES}"
+        assert session is None or exists(style_seed), "incremental upscaling needs a fixed style_seed"
+
+        with self.profile("convert_input"):
+            images = rgb_images(images)
+
+        b, h, w, _ = images.shape
+        output = torch.empty((b, h * 4, w * 4, 3), dtype=torch.float32)
+        scheduler = self.make_scheduler(max_batch_size, style_seed)
+
+        if exists(session):
+            from .incremental import incremental_job
+            session.start((self.tile_cache_namespace(style_seed), mode, seam_overlap, seam_threshold), b)
+            make_job = lambda i, image: incremental_job(self, session, i, image, mode, output[i], seam_overlap=seam_overlap, seam_threshold=seam_threshold)
         else:
-            raise ValueError("weight_type should be either 'gaussian' or 'constant' but got", weight_type)
-        
-        result1 = result1 * weights_2
-        result2 = result2_interior * weights_1
-
-        # Average the overlapping region
-        result1 = (
-            result1 + result2
-        )
+            make_job = lambda i, image: self.make_job(image, mode, out=output[i], seam_overlap=seam_overlap, seam_threshold=seam_threshold)
+
+        # jobs are created lazily so only the images with tiles in flight hold their grids
+        jobs = (make_job(i, image.permute(2, 0, 1)) for i, image in enumerate(images))
+
+        if pool_tiles:
+            self.run_jobs(jobs, scheduler)
+        else:
+            for job in jobs:
+                self.run_jobs([job], scheduler)
+
+        return output
+
+    def stream_bands(self, image_tensor: Tensor, mode: str, scheduler: TileScheduler) -> Iterator[Tensor]:
+        """
+        Upscales a (c, h, w) image one row of tiles at a time and yields the finished
+        (c, rows, 4w) output bands top to bottom, 4h rows in total.
+
+        Only a window of two output tile rows is kept: in the overlapped modes, output band k
+        is complete once base row k and offset rows k and k + 1 (which straddle its top and
+        bottom edges) are in, and the lower half of the window carries offset row k + 1 and the
+        bottom of base row k over into band k + 1. The bands are the same as the rows of the
+        full image the other methods produce.
+        """
+        assert mode in STREAMING_MODES, f"mode must be one of {STREAMING_MODES}"
+        _, h, w = image_tensor.shape
+
+        tile_size = self.input_image_size
+        band_size = tile_size * 4
+
+        image_tensor = self.pad_to_tiles(image_tensor)
+        rows = image_tensor.shape[1] // tile_size
+
+        def band(k):
+            return image_tensor[:, k * tile_size:(k + 1) * tile_size]
+
+        if mode == "4x":
+            for k in range(rows):
+                grid = TileGrid(band(k), tile_size)
+                scheduler.run([grid])
+                yield grid.output[:, :h * 4 - k * band_size, :w * 4]
+            return
+
+        offset = tile_size // 2
+        offset_4x = offset * 4
+        blend = create_blend_weights(band_size, mode.rsplit("_", 1)[-1])
 
-        # Remove padding
-        unpadded = result1[:, : h * 4, : w * 4]
+        image_tensor_offset = torch.nn.functional.pad(image_tensor, (offset, offset, offset, offset), mode='reflect')
 
-        to_pil = transforms.ToPILImage()
-        return to_pil(unpadded)
+        def offset_band(k):
+            return image_tensor_offset[:, k * tile_size:(k + 1) * tile_size]
+
+        # the window holds offset rows k and k + 1, base row k sits in between them
+        window = torch.zeros((3, 2 * band_size, image_tensor_offset.shape[2] * 4), dtype=torch.float32)
+        top, bottom = window[:, :band_size], window[:, band_size:]
+        base = window[:, offset_4x:offset_4x + band_size, offset_4x:-offset_4x]
+
+        scheduler.run([TileGrid(offset_band(0), tile_size, output=top, blend=blend)])
+
+        for k in range(rows):
+            scheduler.run([
+                TileGrid(band(k), tile_size, output=base, blend=blend),
+                TileGrid(offset_band(k + 1), tile_size, output=bottom, blend=blend),
+            ])
+            yield base[:, :h * 4 - k * band_size, :w * 4]
+
+            top.copy_(bottom)
+            bottom.zero_()
+
+    @torch.no_grad()
+    def upscale_to_file(self, image: Tensor, path, mode: str = "4x", max_batch_size=8, style_seed: Optional[int] = None, format: Optional[str] = None):
+        """
+        Out-of-core version of upscale for outputs too large to hold in memory: takes one
+        (h, w, c) float image in [0, 1] and writes the (4h, 4w, 3) result to path as it is
+        produced, one band of tile rows at a time (see stream_bands), as a .png or as a
+        memory-mapped uint8 .npy. format defaults to the extension of path.
+
+        4x_overlapped_seams needs the complete first pass, it is not supported.
+        """
+        if mode not in STREAMING_MODES:
+            raise ValueError(f"mode must be one of {STREAMING_MODES} but got", mode)
+
+        image = rgb_images(image.unsqueeze(0))[0]
+        h, w, _ = image.shape
+        scheduler = self.make_scheduler(max_batch_size, style_seed)
+
+        with open_row_writer(path, h * 4, w * 4, format) as writer:
+            for band in self.stream_bands(image.permute(2, 0, 1), mode, scheduler):
+                with self.profile("write_output"):
+                    band = (band.permute(1, 2, 0) * 255).clamp_(0, 255).to(torch.uint8)
+                    writer.write(band.numpy())
+
+        self.last_schedule_report = scheduler.report()
+        return path
+
+    @torch.no_grad()
+    def upscale_4x(self, image: Image.Image, max_batch_size=8, style_seed: Optional[int] = None) -> Image.Image:
+        with self.profile("convert_input"):
+            image = pil_to_tensor(image)
+        unpadded = self.upscale_4x_tensor(image, max_batch_size, style_seed)
+        with self.profile("convert_output"):
+            return tensor_to_pil(unpadded)
+
+    # Tiled 4x upscaling with overlapping tiles to reduce seam artifacts
+    # weights options are 'checkboard' and 'constant'
+    @torch.no_grad()
+    def upscale_4x_overlapped(self, image, max_batch_size=8, weight_type='checkboard', style_seed: Optional[int] = None):
+        with self.profile("convert_input"):
+            image = pil_to_tensor(image)
+        unpadded = self.upscale_4x_overlapped_tensor(image, max_batch_size, weight_type, style_seed)
+        with self.profile("convert_output"):
+            return tensor_to_pil(unpadded)
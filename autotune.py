@@ -0,0 +1,246 @@
+import hashlib
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+import torch
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+
+# tile batch sizes tried by the calibration, the node's tile_batch_size goes up to 32
+CANDIDATE_BATCH_SIZES = (1, 2, 4, 8, 16, 32)
+
+# the smallest batch size within this fraction of the best throughput is picked, larger
+# batches only cost memory past that point
+THROUGHPUT_TOLERANCE = 0.95
+
+# fraction of the free device memory a batch may use when falling back under memory pressure
+MEMORY_HEADROOM = 0.8
+
+# seconds between two samples of the process' memory while a CPU candidate runs
+RSS_POLL_INTERVAL = 0.002
+
+# part of the profile keys, profiles calibrated with an older way of measuring are calibrated again
+PROFILE_VERSION = 2
+
+profiles_lock = threading.Lock()
+
+
+def device_name(device: torch.device) -> str:
+    if device.type == "cuda":
+        return torch.cuda.get_device_name(device)
+    return f"{device.type}:{platform.machine()}:{platform.processor() or 'unknown'}:{os.cpu_count()}"
+
+
+def config_hash(config: dict) -> str:
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+def profile_key(aura_sr) -> str:
+    dtype = "int8" if aura_sr.quantized else str(aura_sr.dtype).replace("torch.", "")
+    if aura_sr.engine != "torch":
+        dtype = f"{aura_sr.engine}-{dtype}"
+    return f"v{PROFILE_VERSION}|{device_name(aura_sr.device)}|{config_hash(aura_sr.config)}|{dtype}"
+
+
+def max_rss_bytes() -> int:
+    # the peak resident memory over the life of the process (the benchmarks report it), it never
+    # goes down
+    if resource is not None:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == "darwin" else rss * 1024
+    try:
+        import psutil
+    except ImportError:
+        return 0
+    info = psutil.Process().memory_info()
+    return getattr(info, "peak_wset", info.rss)
+
+
+def rss_bytes() -> Optional[int]:
+    # the current resident memory of the process, None when it cannot be read
+    try:
+        import psutil  # a ComfyUI requirement
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class RssSampler:
+    """
+    The peak resident memory of the process while the block runs, over what it was when it started.
+    Sampled by a thread every RSS_POLL_INTERVAL seconds: the process-wide max RSS the OS keeps only
+    ever goes up, so it says nothing about a batch once the process has been larger before.
+    """
+
+    def __init__(self):
+        self.baseline = None
+        self.peak = None
+        self.stopped = threading.Event()
+
+    def poll(self):
+        while not self.stopped.wait(RSS_POLL_INTERVAL):
+            self.peak = max(self.peak, rss_bytes() or 0)
+
+    def __enter__(self):
+        self.baseline = self.peak = rss_bytes()
+        if self.baseline is not None:
+            self.thread = threading.Thread(target=self.poll, daemon=True)
+            self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.baseline is not None:
+            self.stopped.set()
+            self.thread.join()
+            self.peak = max(self.peak, rss_bytes() or 0)
+
+    def peak_bytes(self) -> Optional[int]:
+        return None if self.baseline is None else max(0, self.peak - self.baseline)
+
+
+def is_out_of_memory(e: Exception) -> bool:
+    return isinstance(e, torch.cuda.OutOfMemoryError) or "out of memory" in str(e).lower()
+
+
+@torch.no_grad()
+def calibrate(aura_sr, candidates=CANDIDATE_BATCH_SIZES, repeats=2, max_seconds=10.0) -> dict:
+    """
+    Times the model on random tiles for every candidate batch size, smallest first, and
+    records its throughput and the peak memory the batch needs on top of the loaded model.
+
+    On CUDA the peak comes from the allocator statistics. On the CPU it is the growth of the
+    process' resident memory, sampled while the candidate runs (see RssSampler), or None when
+    it cannot be read: the memory fallback of auto_batch_size then keeps the calibrated size.
+
+    Stops at the first candidate that runs out of memory, takes longer than max_seconds per
+    batch or is not faster than the previous one.
+    """
+    device = aura_sr.device
+    cuda = device.type == "cuda"
+    tile_size = aura_sr.input_image_size
+
+    def sync():
+        if cuda:
+            torch.cuda.synchronize(device)
+
+    results = {}
+    baseline = torch.cuda.memory_allocated(device) if cuda else None
+
+    for batch_size in candidates:
+        tiles = torch.rand((batch_size, 3, tile_size, tile_size), device=device, dtype=aura_sr.dtype)
+        try:
+            if cuda:
+                torch.cuda.reset_peak_memory_stats(device)
+
+            # one warm-up batch (the one whose memory is sampled on the CPU), then the timed ones
+            with RssSampler() as sampler:
+                aura_sr.infer(tiles)
+            sync()
+            start = time.perf_counter()
+            for _ in range(repeats):
+                aura_sr.infer(tiles)
+            sync()
+            seconds = (time.perf_counter() - start) / repeats
+
+            peak = max(0, torch.cuda.max_memory_allocated(device) - baseline) if cuda else sampler.peak_bytes()
+        except RuntimeError as e:
+            if not is_out_of_memory(e):
+                raise
+            if cuda:
+                torch.cuda.empty_cache()
+            break
+        finally:
+            del tiles
+
+        results[batch_size] = {
+            "tiles_per_s": round(batch_size / seconds, 3),
+            "peak_bytes": peak,
+        }
+
+        previous = results.get(batch_size // 2)
+        if seconds > max_seconds or (previous is not None and results[batch_size]["tiles_per_s"] <= previous["tiles_per_s"]):
+            break
+
+    if cuda:
+        torch.cuda.empty_cache()
+    return results
+
+
+def choose_batch_size(results: dict) -> int:
+    # 1 when even that ran out of memory
+    if not results:
+        return 1
+    best = max(result["tiles_per_s"] for result in results.values())
+    return min(int(batch_size) for batch_size, result in results.items() if result["tiles_per_s"] >= best * THROUGHPUT_TOLERANCE)
+
+
+def load_profiles(path) -> dict:
+    try:
+        return json.loads(Path(path).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def save_profiles(path, profiles: dict):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp = path.with_suffix(f".{os.getpid()}.tmp")
+    temp.write_text(json.dumps(profiles, indent=2))
+    os.replace(temp, path)
+
+
+def get_profile(aura_sr, path) -> dict:
+    # the calibration profile of this model/device/dtype, calibrated and stored on first use
+    key = profile_key(aura_sr)
+    with profiles_lock:
+        profile = load_profiles(path).get(key)
+        if profile is None:
+            print("[AuraSR-ComfyUI] Calibrating tile_batch_size for this device, only done once...")
+            results = calibrate(aura_sr)
+            profile = {"batch_size": choose_batch_size(results), "results": results}
+
+            profiles = load_profiles(path)
+            profiles[key] = profile
+            try:
+                save_profiles(path, profiles)
+            except OSError as e:
+                print(f"[AuraSR-ComfyUI] Could not save the tile_batch_size profile: {e}")
+            print(f"[AuraSR-ComfyUI] Picked tile_batch_size={profile['batch_size']}.")
+    return profile
+
+
+def auto_batch_size(aura_sr, path, free_memory=None) -> int:
+    """
+    The calibrated tile batch size for this model on its device and dtype. With free_memory
+    (bytes) given, falls back to the largest calibrated batch size below it whose peak memory
+    fits into MEMORY_HEADROOM of it. Batch sizes whose peak could not be measured are assumed
+    to fit.
+    """
+    profile = get_profile(aura_sr, path)
+    batch_size = profile["batch_size"]
+    if free_memory is None:
+        return batch_size
+
+    fitting = [
+        int(size) for size, result in profile["results"].items()
+        if int(size) <= batch_size and (result["peak_bytes"] is None or result["peak_bytes"] <= free_memory * MEMORY_HEADROOM)
+    ]
+    fallback = max(fitting, default=1)
+    if fallback < batch_size:
+        print(f"[AuraSR-ComfyUI] Low memory, using tile_batch_size={fallback} instead of {batch_size}.")
+    return fallback
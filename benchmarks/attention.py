@@ -0,0 +1,98 @@
+# Per layer timings of the attention backends (sdpa, math, chunked) on CPU:
+#
+#   python benchmarks/attention.py --batch-sizes 1 8 --config config.json
+#
+# Runs one tile batch through the model to record the input of every attention layer (the
+# sequence length each Transformer level sees is the tile size divided down to that level),
+# then times each distinct layer shape with each backend and reports the largest difference to
+# the 'math' output. The released configs only build full attention layers, the linear ones
+# (which have no fused kernel, 'sdpa' runs them like 'math') show up with configs that use them.
+# --chunk-size changes the block size of the chunked backend.
+import argparse
+import time
+
+import torch
+
+from common import add_model_arguments, import_module, load_aura_sr, write_json
+
+
+def record_layers(model, tiles, noise):
+    # (name, layer, input) of the first layer of each distinct kind and input shape
+    aura_sr = import_module("aura_sr")
+    inputs, hooks = {}, []
+    for name, module in model.upsampler.named_modules():
+        if isinstance(module, (aura_sr.Attention, aura_sr.LinearAttention)):
+            def hook(module, args, name=name):
+                inputs.setdefault((type(module).__name__, tuple(args[0].shape)), (name, module, args[0].clone()))
+            hooks.append(module.register_forward_pre_hook(hook))
+
+    try:
+        model.upsampler(lowres_image=tiles, noise=noise)
+    finally:
+        for hook in hooks:
+            hook.remove()
+    return list(inputs.values())
+
+
+def time_layer(layer, x, repeats):
+    sync = torch.cuda.synchronize if x.is_cuda else (lambda: None)
+    output = layer(x)  # warm-up
+    sync()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        layer(x)
+    sync()
+    return output, (time.perf_counter() - start) / repeats
+
+
+def main():
+    aura_sr = import_module("aura_sr")
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_model_arguments(parser)
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 8])
+    parser.add_argument("--precision", default="fp32", choices=list(aura_sr.PRECISIONS))
+    parser.add_argument("--chunk-size", type=int, default=aura_sr.ATTENTION_CHUNK_SIZE, help="elements per block of the chunked backend")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    aura_sr.ATTENTION_CHUNK_SIZE = args.chunk_size
+    model = load_aura_sr(args, precision=args.precision)
+    size = model.input_image_size
+    results = []
+
+    for batch_size in args.batch_sizes:
+        generator = torch.Generator().manual_seed(batch_size)
+        tiles = torch.rand((batch_size, 3, size, size), generator=generator).to(model.device, model.dtype)
+        noise = torch.randn((batch_size, model.upsampler.style_network.dim_in), generator=generator).to(model.device, model.dtype)
+
+        for name, layer, x in record_layers(model, tiles, noise):
+            reference = None
+            for backend in ("math", "sdpa", "chunked"):
+                model.set_attention_backend(backend)
+                output, seconds = time_layer(layer, x, args.repeats)
+                reference = output if reference is None else reference
+
+                results.append({
+                    "batch_size": batch_size,
+                    "layer": name,
+                    "kind": "full" if isinstance(layer, aura_sr.Attention) else "linear",
+                    "sequence_length": x.shape[-2] * x.shape[-1],
+                    "backend": backend,
+                    "ms": round(seconds * 1000, 3),
+                    "max_abs_diff": (output.float() - reference.float()).abs().max().item(),
+                })
+        model.set_attention_backend(None)
+
+    print(f"{'batch':>5} {'layer':>18} {'kind':>6} {'seq len':>7} {'backend':>8} {'ms':>9} {'max diff':>9}")
+    for r in results:
+        print(f"{r['batch_size']:>5} {r['layer']:>18} {r['kind']:>6} {r['sequence_length']:>7} {r['backend']:>8} {r['ms']:>9.3f} {r['max_abs_diff']:>9.2e}")
+
+    if args.json:
+        write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    with torch.no_grad():
+        main()
@@ -0,0 +1,77 @@
+# Per tile batch timings of UnetUpsampler in NCHW and channels_last:
+#
+#   python benchmarks/channels_last.py --batch-sizes 1 4 8 --precision bf16
+#
+# Runs the same random tiles and style noise through the 'weight' and 'activation' conv modes
+# in NCHW and through channels_last (which implies 'activation'), and reports the time per
+# batch and the largest difference to the NCHW 'activation' output.
+import argparse
+import time
+
+import torch
+
+from common import add_model_arguments, import_module, load_aura_sr, write_json
+
+
+def time_batch(model, tiles, noise, repeats):
+    sync = torch.cuda.synchronize if tiles.is_cuda else (lambda: None)
+    output = model.upsampler(lowres_image=tiles, noise=noise)  # warm-up
+    sync()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        model.upsampler(lowres_image=tiles, noise=noise)
+    sync()
+    return output, (time.perf_counter() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_model_arguments(parser)
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 4, 8])
+    parser.add_argument("--precision", default="fp32", choices=list(import_module("aura_sr").PRECISIONS))
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    model = load_aura_sr(args, precision=args.precision)
+    size = model.input_image_size
+    variants = [("nchw", "weight"), ("nchw", "activation"), ("channels_last", "activation")]
+    results = []
+
+    for batch_size in args.batch_sizes:
+        generator = torch.Generator().manual_seed(batch_size)
+        tiles = torch.rand((batch_size, 3, size, size), generator=generator).to(model.device, model.dtype)
+        noise = torch.randn((batch_size, model.upsampler.style_network.dim_in), generator=generator).to(model.device, model.dtype)
+
+        reference = None
+        for layout, conv_mode in variants:
+            model.set_channels_last(layout == "channels_last")
+            model.upsampler.set_conv_mode(conv_mode)
+
+            # the noise augmentation is random, fix it for the comparison
+            torch.manual_seed(0)
+            output, seconds = time_batch(model, tiles, noise, args.repeats)
+            if conv_mode == "activation" and reference is None:
+                reference = output
+
+            results.append({
+                "batch_size": batch_size,
+                "layout": layout,
+                "conv_mode": conv_mode,
+                "ms_per_batch": round(seconds * 1000, 2),
+                "tiles_per_s": round(batch_size / seconds, 2),
+                "max_abs_diff": (output.float() - reference.float()).abs().max().item() if reference is not None else None,
+            })
+
+    print(f"{'batch':>5} {'layout':>13} {'conv_mode':>10} {'ms/batch':>9} {'tiles/s':>8} {'max diff':>9}")
+    for r in results:
+        diff = "" if r["max_abs_diff"] is None else f"{r['max_abs_diff']:.2e}"
+        print(f"{r['batch_size']:>5} {r['layout']:>13} {r['conv_mode']:>10} {r['ms_per_batch']:>9.2f} {r['tiles_per_s']:>8.2f} {diff:>9}")
+
+    if args.json:
+        write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    with torch.no_grad():
+        main()
@@ -0,0 +1,96 @@
+# Time to first upscale and peak RAM of a fresh process, loading the model the regular way
+# (random initialisation, whole checkpoint read, load_state_dict) and through the fast path
+# (meta device, memory-mapped safetensors, see aura_sr.load_upsampler):
+#
+#   python benchmarks/cold_start.py --config config.json --checkpoint model.safetensors
+#
+# Each method runs in its own python process, so the peak RSS is that of the load alone.
+# Without --checkpoint a random one of the --config (or tiny) model is written to a temp file.
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import torch
+
+from common import add_model_arguments, import_module, load_aura_sr, load_config, write_json
+
+
+METHODS = ("regular", "fast")
+
+
+def run(args):
+    # one measurement, in the child process
+    start = time.perf_counter()
+    aura_sr = import_module("aura_sr")
+    config = load_config(args)
+    if args.run == "fast":
+        model = aura_sr.AuraSR.from_checkpoint(config, args.checkpoint, device=args.device, precision=args.precision)
+    else:
+        from safetensors.torch import load_file
+        model = aura_sr.AuraSR(config, device=args.device, precision=args.precision)
+        model.upsampler.load_state_dict(load_file(args.checkpoint), strict=True)
+    if model.device.type == "cuda":
+        torch.cuda.synchronize()
+    loaded = time.perf_counter() - start
+
+    size = model.input_image_size
+    model.upscale(torch.rand((1, size * 2, size * 2, 3)), mode="4x", max_batch_size=args.batch_size, style_seed=0)
+    if model.device.type == "cuda":
+        torch.cuda.synchronize()
+    first = time.perf_counter() - start
+
+    max_rss_bytes = import_module("autotune").max_rss_bytes
+    print(json.dumps({"load_s": round(loaded, 3), "first_upscale_s": round(first, 3), "peak_rss_mb": round(max_rss_bytes() / (1 << 20), 1)}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_model_arguments(parser)
+    parser.add_argument("--precision", default="fp32", choices=list(import_module("aura_sr").PRECISIONS))
+    parser.add_argument("--repeats", type=int, default=3, help="processes per method, the fastest is reported")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--run", choices=METHODS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        with torch.no_grad():
+            run(args)
+        return
+
+    temp = None
+    if not args.checkpoint:
+        from safetensors.torch import save_file
+        temp = tempfile.NamedTemporaryFile(suffix=".safetensors", delete=False)
+        temp.close()
+        save_file(load_aura_sr(args).upsampler.state_dict(), temp.name)
+        args.checkpoint = temp.name
+
+    command = [sys.executable, os.path.abspath(__file__), "--checkpoint", args.checkpoint, "--device", args.device,
+               "--batch-size", str(args.batch_size), "--precision", args.precision]
+    if args.config:
+        command += ["--config", args.config]
+
+    results = []
+    try:
+        for method in METHODS:
+            runs = [json.loads(subprocess.check_output(command + ["--run", method], text=True).strip().splitlines()[-1]) for _ in range(args.repeats)]
+            best = min(runs, key=lambda r: r["first_upscale_s"])
+            results.append({"method": method, **best})
+    finally:
+        if temp is not None:
+            os.unlink(temp.name)
+
+    print(f"{'method':>8} {'load s':>8} {'first upscale s':>16} {'peak RSS MB':>12}")
+    for r in results:
+        print(f"{r['method']:>8} {r['load_s']:>8.3f} {r['first_upscale_s']:>16.3f} {r['peak_rss_mb']:>12.1f}")
+
+    if args.json:
+        write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# Helpers shared by the benchmark scripts. They run from a plain checkout, without ComfyUI
+# and without a GPU or network access, e.g.:
+#
+#   python benchmarks/seam_refine.py --sizes 256x256 512x512
+#
+# Without --config/--checkpoint the model is a tiny, randomly initialised UnetUpsampler with
+# the same structure as the released ones: timings are relative, outputs are meaningless.
+import argparse
+import importlib
+import json
+import sys
+import time
+import types
+from pathlib import Path
+
+import torch
+
+
+ROOT = Path(__file__).resolve().parent.parent
+PACKAGE = "aurasr_bench"
+
+TINY_CONFIG = {
+    "dim": 8,
+    "image_size": 256,
+    "input_image_size": 64,
+    "style_network": {"dim_in": 128, "dim_out": 64, "depth": 2},
+    "self_attn_dim_head": 8,
+    "self_attn_heads": 2,
+    "num_conv_kernels": 2,
+}
+
+
+def import_module(name):
+    # the repository is a ComfyUI custom node package, its __init__.py needs ComfyUI:
+    # register an empty package over the checkout so relative imports still resolve
+    if PACKAGE not in sys.modules:
+        package = types.ModuleType(PACKAGE)
+        package.__path__ = [str(ROOT)]
+        sys.modules[PACKAGE] = package
+    return importlib.import_module(f"{PACKAGE}.{name}")
+
+
+def add_model_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--config", help="model config.json (default: tiny synthetic config)")
+    parser.add_argument("--checkpoint", help="model .safetensors/.ckpt (default: random weights)")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--batch-size", type=int, default=8, help="tile batch size")
+    parser.add_argument("--style-seed", type=int, default=0, help="fixed style seed, -1 for random styles")
+
+
+def load_config(args):
+    if args.config:
+        return json.loads(Path(args.config).read_text())
+    return TINY_CONFIG
+
+
+def load_aura_sr(args, **kwargs):
+    aura_sr = import_module("aura_sr")
+
+    torch.manual_seed(0)
+    model = aura_sr.AuraSR(load_config(args), device=args.device, **kwargs)
+
+    if args.checkpoint:
+        if args.checkpoint.endswith(".safetensors"):
+            from safetensors.torch import load_file
+            checkpoint = load_file(args.checkpoint)
+        else:
+            checkpoint = torch.load(args.checkpoint, map_location="cpu", weights_only=True)
+        model.upsampler.load_state_dict(checkpoint, strict=True)
+
+    return model
+
+
+def style_seed(args):
+    return args.style_seed if args.style_seed >= 0 else None
+
+
+def parse_size(size):
+    h, w = size.lower().split("x")
+    return int(h), int(w)
+
+
+def test_images(size, batch=1, seed=0):
+    # smooth random structure plus fine noise, (b, h, w, 3) in [0, 1]
+    h, w = size
+    generator = torch.Generator().manual_seed(seed)
+    coarse = torch.rand((batch, 3, max(1, h // 16), max(1, w // 16)), generator=generator)
+    images = torch.nn.functional.interpolate(coarse, (h, w), mode="bicubic", align_corners=False)
+    images = images + 0.05 * torch.randn((batch, 3, h, w), generator=generator)
+    return images.clamp(0, 1).permute(0, 2, 3, 1).contiguous()
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def psnr(a, b):
+    mse = torch.mean((a.float() - b.float()) ** 2).item()
+    return float("inf") if mse == 0 else 10 * torch.log10(torch.tensor(1.0 / mse)).item()
+
+
+def write_json(path, results):
+    Path(path).write_text(json.dumps(results, indent=2))
+    print(f"results written to {path}")
@@ -0,0 +1,95 @@
+# What registering the nodes costs at ComfyUI startup: imports the package the way ComfyUI loads
+# custom nodes, after ComfyUI's own modules, under `python -X importtime`:
+#
+#   python benchmarks/import_time.py --comfyui /path/to/ComfyUI --check
+#
+# Reports the wall time of the package import and the modules it pulled in, slowest first.
+# --check exits with an error when one of the modules that must wait for the first node
+# execution (the model code and its heavy dependencies) was imported, for use in CI.
+import argparse
+import subprocess
+import sys
+
+from common import ROOT, write_json
+
+
+# imported on first execution only
+DEFERRED_MODULES = ("aura_sr", "incremental", "onnx_engine", "quantization", "scheduler", "torchvision", "einops", "onnx", "onnxruntime")
+
+# ComfyUI's modules the nodes use, already imported by ComfyUI when custom nodes load
+COMFYUI_MODULES = ("folder_paths", "comfy.model_management", "comfy.utils")
+
+MARKER = "-- aurasr import --"
+
+CHILD = """
+import importlib, importlib.util, sys, time
+sys.path.insert(0, {comfyui!r})
+for name in {comfyui_modules!r}:
+    importlib.import_module(name)
+sys.stderr.write({marker!r} + "\\n")
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location({name!r}, {init!r})
+module = importlib.util.module_from_spec(spec)
+sys.modules[{name!r}] = module
+spec.loader.exec_module(module)
+print(time.perf_counter() - start)
+"""
+
+
+def default_comfyui():
+    # the usual install location: ComfyUI/custom_nodes/<this package>
+    candidate = ROOT.parent.parent
+    return str(candidate) if (candidate / "folder_paths.py").exists() else None
+
+
+def parse_importtime(stderr):
+    # 'import time: self [us] | cumulative | imported package' lines after the marker
+    lines = stderr.split(MARKER, 1)[-1].splitlines()
+    modules = []
+    for line in lines:
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        modules.append({"module": name.strip(), "self_ms": int(self_us) / 1000, "cumulative_ms": int(cumulative_us) / 1000})
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--comfyui", default=default_comfyui(), help="ComfyUI folder (default: the one this package is installed in)")
+    parser.add_argument("--top", type=int, default=15, help="how many modules to list")
+    parser.add_argument("--check", action="store_true", help="fail when a deferred module was imported")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    if args.comfyui is None:
+        parser.error("ComfyUI was not found next to this package, pass --comfyui")
+
+    name = ROOT.name
+    child = CHILD.format(comfyui=args.comfyui, comfyui_modules=COMFYUI_MODULES, marker=MARKER, name=name, init=str(ROOT / "__init__.py"))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", child], capture_output=True, text=True, cwd=args.comfyui)
+    if result.returncode != 0:
+        sys.exit(result.stderr)
+
+    wall_s = float(result.stdout.strip().splitlines()[-1])
+    modules = parse_importtime(result.stderr)
+    deferred = [m["module"] for m in modules if m["module"].split(".")[0] in DEFERRED_MODULES or m["module"].split(".")[-1] in DEFERRED_MODULES]
+
+    print(f"package import: {wall_s * 1000:.1f} ms, {len(modules)} new modules")
+    print(f"{'self ms':>9} {'cumul. ms':>10}  module")
+    for m in sorted(modules, key=lambda m: m["self_ms"], reverse=True)[:args.top]:
+        print(f"{m['self_ms']:>9.2f} {m['cumulative_ms']:>10.2f}  {m['module']}")
+
+    if args.json:
+        write_json(args.json, {"import_ms": round(wall_s * 1000, 2), "modules": modules, "deferred_imported": deferred})
+
+    if deferred:
+        # one name per package, e.g. 'torchvision' for its hundred submodules
+        names = {m if m.startswith(f"{name}.") else m.split(".")[0] for m in deferred}
+        print(f"imported at registration: {', '.join(sorted(names))}")
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
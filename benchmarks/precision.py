@@ -0,0 +1,65 @@
+# Quality and speed of the reduced precision modes against fp32, through AuraSR.upscale:
+#
+#   python benchmarks/precision.py --precisions fp32 bf16 --sizes 256x256
+#
+# Every precision gets the same weights and a fixed style seed (the style noise and the input
+# noise augmentation are then the same too), so the PSNR against the fp32 output only
+# measures the rounding of the reduced precision.
+import argparse
+
+import torch
+
+from common import add_model_arguments, import_module, load_aura_sr, parse_size, psnr, style_seed, test_images, timed, write_json
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_model_arguments(parser)
+    parser.add_argument("--precisions", nargs="+", default=["fp32", "bf16"], choices=list(import_module("aura_sr").PRECISIONS))
+    parser.add_argument("--sizes", nargs="+", default=["256x256"], help="input sizes, HxW")
+    parser.add_argument("--mode", default="4x")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    if args.style_seed < 0:
+        parser.error("the comparison needs a fixed --style-seed")
+
+    precisions = ["fp32", *[p for p in args.precisions if p != "fp32"]]
+    cuda = args.device.startswith("cuda")
+    results = []
+
+    for size in map(parse_size, args.sizes):
+        images = test_images(size)
+        reference = None
+
+        for precision in precisions:
+            model = load_aura_sr(args, precision=precision)
+            weight_bytes = sum(p.numel() * p.element_size() for p in model.upsampler.parameters())
+
+            if cuda:
+                torch.cuda.reset_peak_memory_stats()
+            model.upscale(images, mode=args.mode, max_batch_size=args.batch_size, style_seed=style_seed(args))  # warm-up
+            output, seconds = timed(model.upscale, images, mode=args.mode, max_batch_size=args.batch_size, style_seed=style_seed(args))
+
+            reference = output if reference is None else reference
+            results.append({
+                "size": list(size),
+                "precision": precision,
+                "seconds": round(seconds, 3),
+                "weight_mb": round(weight_bytes / 2**20, 2),
+                "peak_mb": round(torch.cuda.max_memory_allocated() / 2**20, 1) if cuda else None,
+                "psnr_vs_fp32": round(psnr(output, reference), 2),
+            })
+            del model
+
+    print(f"{'size':>11} {'precision':>9} {'seconds':>8} {'weights MB':>10} {'peak MB':>8} {'psnr':>7}")
+    for r in results:
+        print(f"{'x'.join(map(str, r['size'])):>11} {r['precision']:>9} {r['seconds']:>8.2f} {r['weight_mb']:>10.2f} {str(r['peak_mb']):>8} {r['psnr_vs_fp32']:>7}")
+
+    if args.json:
+        write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    with torch.no_grad():
+        main()
@@ -0,0 +1,76 @@
+# Accuracy and speed of the int8 CPU engine against the fp32 model it is made from:
+#
+#   python benchmarks/quantization.py --sizes 256x256 --conv-mode weight activation
+#
+# Both get the same weights and a fixed style seed, so the PSNR against fp32 only measures
+# the quantisation error. Model size is the size of the serialised state dict.
+import argparse
+import copy
+import io
+
+import torch
+
+from common import add_model_arguments, load_aura_sr, parse_size, psnr, style_seed, test_images, timed, write_json
+
+
+def state_dict_mb(module):
+    buffer = io.BytesIO()
+    torch.save(module.state_dict(), buffer)
+    return buffer.tell() / 2**20
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_model_arguments(parser)
+    parser.add_argument("--sizes", nargs="+", default=["256x256"], help="input sizes, HxW")
+    parser.add_argument("--mode", default="4x")
+    parser.add_argument("--conv-mode", nargs="+", default=["weight"], choices=["weight", "activation"])
+    parser.add_argument("--repeats", type=int, default=2)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    if args.device != "cpu":
+        parser.error("the int8 engine is CPU only")
+    if args.style_seed < 0:
+        parser.error("the comparison needs a fixed --style-seed")
+
+    fp32 = load_aura_sr(args)
+    models = {"fp32": fp32, "int8": copy.deepcopy(fp32).quantize()}
+    sizes_mb = {name: round(state_dict_mb(model.upsampler), 2) for name, model in models.items()}
+    results = []
+
+    for size in map(parse_size, args.sizes):
+        images = test_images(size)
+
+        for conv_mode in args.conv_mode:
+            reference = None
+            for name, model in models.items():
+                model.upsampler.set_conv_mode(conv_mode)
+                model.upscale(images, mode=args.mode, max_batch_size=args.batch_size, style_seed=style_seed(args))  # warm-up
+
+                seconds = []
+                for _ in range(args.repeats):
+                    output, elapsed = timed(model.upscale, images, mode=args.mode, max_batch_size=args.batch_size, style_seed=style_seed(args))
+                    seconds.append(elapsed)
+
+                reference = output if reference is None else reference
+                results.append({
+                    "size": list(size),
+                    "conv_mode": conv_mode,
+                    "engine": name,
+                    "seconds": round(min(seconds), 3),
+                    "model_mb": sizes_mb[name],
+                    "psnr_vs_fp32": round(psnr(output, reference), 2),
+                })
+
+    print(f"{'size':>11} {'conv_mode':>10} {'engine':>6} {'seconds':>8} {'model MB':>9} {'psnr':>7}")
+    for r in results:
+        print(f"{'x'.join(map(str, r['size'])):>11} {r['conv_mode']:>10} {r['engine']:>6} {r['seconds']:>8.2f} {r['model_mb']:>9.2f} {r['psnr_vs_fp32']:>7}")
+
+    if args.json:
+        write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    with torch.no_grad():
+        main()
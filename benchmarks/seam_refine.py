@@ -0,0 +1,90 @@
+# Compares the seam refinement mode against the full half-tile offset pass:
+#
+#   python benchmarks/seam_refine.py --sizes 512x512 1024x768 --seam-overlap 32 64
+#
+# For each image size it reports the wall time and the number of tiles run by 4x,
+# 4x_overlapped_checkboard and 4x_overlapped_seams, how visible the base grid seams
+# are in each output (step across a seam relative to the steps right next to it,
+# ~1 means invisible: the mean over all seams and the worst tile-long seam segment)
+# and the PSNR of the seam refined output against the checkboard one.
+#
+# 4x_overlapped_seams runs once per --seam-threshold. Above 0 it skips the straddling
+# tiles whose seam scores below the threshold: 'skipped' counts them, and the PSNR
+# against the threshold 0 run (which re-runs every straddling tile) is what they cost.
+import argparse
+
+import torch
+
+from common import add_model_arguments, load_aura_sr, parse_size, psnr, style_seed, test_images, timed, write_json
+
+
+def seam_visibility(image, tile_size):
+    # image: (h, w, c), (mean over every interior seam of the base tile grid, worst
+    # tile-long segment of a seam)
+    steps, near, worst = 0.0, 0.0, 0.0
+    for axis in (0, 1):
+        x = image.movedim(axis, 0)
+        for seam in range(tile_size, x.shape[0] - 1, tile_size):
+            step = (x[seam] - x[seam - 1]).abs().sum(dim=-1)
+            beside = ((x[seam - 1] - x[seam - 2]).abs().sum(dim=-1) + (x[seam + 1] - x[seam]).abs().sum(dim=-1)) / 2
+            steps += step.sum().item()
+            near += beside.sum().item()
+            for start in range(0, len(step), tile_size):
+                segment = beside[start:start + tile_size].sum().item()
+                if segment > 0:
+                    worst = max(worst, step[start:start + tile_size].sum().item() / segment)
+    return (steps / near if near > 0 else 1.0), worst
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_model_arguments(parser)
+    parser.add_argument("--sizes", nargs="+", default=["256x256", "512x512"], help="input sizes, HxW")
+    parser.add_argument("--seam-overlap", nargs="+", type=int, default=[64])
+    parser.add_argument("--seam-threshold", nargs="+", type=float, default=[0.0, 1.5], help="0 re-runs every straddling tile")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    model = load_aura_sr(args)
+    tile_size = model.input_image_size * 4
+    results = []
+
+    for size in map(parse_size, args.sizes):
+        images = test_images(size)
+        runs = [("4x", {}), ("4x_overlapped_checkboard", {})]
+        # the threshold 0 run of each overlap first, the others are compared against it
+        thresholds = sorted(set(args.seam_threshold) | {0.0})
+        runs += [("4x_overlapped_seams", {"seam_overlap": overlap, "seam_threshold": threshold}) for overlap in args.seam_overlap for threshold in thresholds]
+
+        outputs, tiles_run = {}, {}
+        for mode, options in runs:
+            output, seconds = timed(model.upscale, images, mode=mode, max_batch_size=args.batch_size, style_seed=style_seed(args), **options)
+            label = mode if not options else f"{mode}[overlap={options['seam_overlap']},threshold={options['seam_threshold']:g}]"
+            outputs[label] = output
+            tiles = tiles_run[label] = model.last_schedule_report["infer"]["tiles"]
+            all_tiles = mode if not options else f"{mode}[overlap={options['seam_overlap']},threshold=0]"
+            visibility, worst = seam_visibility(output[0], tile_size)
+
+            results.append({
+                "size": list(size),
+                "mode": label,
+                "seconds": round(seconds, 3),
+                "tiles": tiles,
+                "skipped": tiles_run[all_tiles] - tiles,
+                "seam_visibility": round(visibility, 4),
+                "worst_seam": round(worst, 4),
+                "psnr_vs_checkboard": round(psnr(output, outputs["4x_overlapped_checkboard"]), 2) if "4x_overlapped_checkboard" in outputs else None,
+                "psnr_vs_all_tiles": round(psnr(output, outputs[all_tiles]), 2) if label != all_tiles else None,
+            })
+
+    print(f"{'size':>11} {'mode':<54} {'seconds':>8} {'tiles':>6} {'skipped':>7} {'seams':>6} {'worst':>6} {'psnr':>7} {'vs all':>7}")
+    for r in results:
+        print(f"{'x'.join(map(str, r['size'])):>11} {r['mode']:<54} {r['seconds']:>8.2f} {r['tiles']:>6} {r['skipped']:>7} {r['seam_visibility']:>6.3f} {r['worst_seam']:>6.3f} {str(r['psnr_vs_checkboard']):>7} {str(r['psnr_vs_all_tiles']):>7}")
+
+    if args.json:
+        write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    with torch.no_grad():
+        main()
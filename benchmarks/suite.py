@@ -0,0 +1,176 @@
+# Standalone CPU benchmark suite: no checkpoint, GPU or network needed.
+#
+#   python benchmarks/suite.py --json results.json
+#   python benchmarks/suite.py --configs tiny small path/to/config.json --sizes 128x128 256x256 --batch-sizes 1 4 8
+#   python benchmarks/suite.py --json new.json --compare old.json
+#
+# Runs AuraSR.upscale_4x and upscale_4x_overlapped (checkboard and constant) on a random image for
+# every config x size x max_batch_size, each case in a fresh process so its peak RSS is its own.
+# The models get random weights: 'tiny' and 'small' are synthetic configs, a path to a config.json
+# (e.g. the released one) builds a model of that shape. Reported per case:
+#
+#   tiles_per_s  - model tiles over the wall time of the upscale
+#   convert_s    - PIL image -> tensor and back
+#   tiling_s     - padding, splitting into tiles, blending and cropping (the rest of the tensor upscale)
+#   stage_s      - gathering the tile batches and moving them to the model's dtype/device
+#   forward_s    - the model
+#   merge_s      - writing the outputs back into the tile grids
+#   peak_rss_mb  - peak resident memory of the process
+#
+# --compare prints the tiles/s change of every case also found in an earlier results file.
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import torch
+
+from common import ROOT, TINY_CONFIG, import_module, parse_size, write_json
+
+
+CONFIGS = {
+    "tiny": TINY_CONFIG,
+    "small": {**TINY_CONFIG, "dim": 32, "style_network": {"dim_in": 128, "dim_out": 256, "depth": 2}, "self_attn_dim_head": 32, "self_attn_heads": 4},
+}
+
+MODES = {
+    "4x": lambda model, image, batch_size: model.upscale_4x_tensor(image, batch_size),
+    "4x_overlapped_checkboard": lambda model, image, batch_size: model.upscale_4x_overlapped_tensor(image, batch_size, weight_type="checkboard"),
+    "4x_overlapped_constant": lambda model, image, batch_size: model.upscale_4x_overlapped_tensor(image, batch_size, weight_type="constant"),
+}
+
+
+def load_config(name):
+    if name in CONFIGS:
+        return CONFIGS[name]
+    return json.loads(Path(name).read_text())
+
+
+def config_name(name):
+    return name if name in CONFIGS else Path(name).stem
+
+
+def run_case(case):
+    # one case, in the child process, result printed as a json line
+    from PIL import Image
+
+    aura_sr = import_module("aura_sr")
+    max_rss_bytes = import_module("autotune").max_rss_bytes
+    if case["threads"]:
+        torch.set_num_threads(case["threads"])
+
+    torch.manual_seed(0)
+    model = aura_sr.AuraSR(load_config(case["config"]), device="cpu")
+    h, w = parse_size(case["size"])
+    generator = torch.Generator().manual_seed(0)
+    image = Image.fromarray((torch.rand((h, w, 3), generator=generator) * 255).to(torch.uint8).numpy())
+    upscale = MODES[case["mode"]]
+
+    with torch.no_grad():
+        upscale(model, aura_sr.pil_to_tensor(image), case["batch_size"])  # warm-up
+
+        runs = []
+        for _ in range(case["repeats"]):
+            start = time.perf_counter()
+            tensor = aura_sr.pil_to_tensor(image)
+            converted = time.perf_counter()
+            output = upscale(model, tensor, case["batch_size"])
+            upscaled = time.perf_counter()
+            aura_sr.tensor_to_pil(output)
+            end = time.perf_counter()
+
+            report = model.last_schedule_report
+            stages = {name: report[name]["busy_s"] for name in ("stage", "infer", "merge")}
+            tiles = report["infer"]["tiles"]
+            runs.append({
+                "wall_s": end - start,
+                "tiles": tiles,
+                "tiles_per_s": tiles / (end - start),
+                "convert_s": (converted - start) + (end - upscaled),
+                "tiling_s": max(0.0, (upscaled - converted) - sum(stages.values())),
+                "stage_s": stages["stage"],
+                "forward_s": stages["infer"],
+                "merge_s": stages["merge"],
+            })
+
+    # the fastest run, the others only add noise from the rest of the machine
+    best = max(runs, key=lambda r: r["tiles_per_s"])
+    result = {**case, "config": config_name(case["config"]), **{k: round(v, 4) if isinstance(v, float) else v for k, v in best.items()}}
+    result["peak_rss_mb"] = round(max_rss_bytes() / (1 << 20), 1)
+    print(json.dumps(result))
+
+
+def environment():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "machine": f"{platform.machine()} {platform.processor() or ''}".strip(),
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def case_key(result):
+    return (result["config"], result["mode"], result["size"], result["batch_size"])
+
+
+def compare(results, path):
+    previous = {case_key(r): r for r in json.loads(Path(path).read_text())["results"]}
+    print(f"\ncompared to {path}:")
+    print(f"{'config':>8} {'mode':>26} {'size':>9} {'batch':>5} {'tiles/s':>8} {'before':>8} {'change':>7}")
+    for r in results:
+        before = previous.get(case_key(r))
+        if before is None:
+            continue
+        change = r["tiles_per_s"] / before["tiles_per_s"] - 1
+        print(f"{r['config']:>8} {r['mode']:>26} {r['size']:>9} {r['batch_size']:>5} {r['tiles_per_s']:>8.2f} {before['tiles_per_s']:>8.2f} {change:>+7.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--configs", nargs="+", default=["tiny"], help=f"{', '.join(CONFIGS)} or paths to config.json files")
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=list(MODES))
+    parser.add_argument("--sizes", nargs="+", default=["128x128", "256x256"], help="input sizes, HxW")
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 4, 8])
+    parser.add_argument("--repeats", type=int, default=2, help="timed runs per case, after a warm-up")
+    parser.add_argument("--threads", type=int, default=0, help="torch CPU threads (default: torch's)")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="an earlier --json file to compare against")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        run_case(json.loads(args.run_case))
+        return
+
+    results = []
+    print(f"{'config':>8} {'mode':>26} {'size':>9} {'batch':>5} {'tiles/s':>8} {'convert':>8} {'tiling':>8} {'stage':>8} {'forward':>8} {'merge':>8} {'RSS MB':>8}")
+    for config in args.configs:
+        for mode in args.modes:
+            for size in args.sizes:
+                for batch_size in args.batch_sizes:
+                    case = {"config": config, "mode": mode, "size": size, "batch_size": batch_size, "repeats": args.repeats, "threads": args.threads}
+                    output = subprocess.check_output([sys.executable, os.path.abspath(__file__), "--run-case", json.dumps(case)], text=True)
+                    r = json.loads(output.strip().splitlines()[-1])
+                    results.append(r)
+                    print(f"{r['config']:>8} {r['mode']:>26} {r['size']:>9} {r['batch_size']:>5} {r['tiles_per_s']:>8.2f} {r['convert_s']:>8.4f} {r['tiling_s']:>8.4f} "
+                          f"{r['stage_s']:>8.4f} {r['forward_s']:>8.4f} {r['merge_s']:>8.4f} {r['peak_rss_mb']:>8.1f}")
+
+    if args.json:
+        write_json(args.json, {"environment": environment(), "results": results})
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import copy
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Optional
+
+
+class ModelConfig:
+    # the config resolved for a checkpoint, fallback is True when it is the root 'config.json'
+    def __init__(self, path: Path, config: dict[str, Any], fallback: bool = False, upscaling_factor: Optional[int] = None):
+        self.path = path
+        self.config = config
+        self.fallback = fallback
+        self.upscaling_factor = upscaling_factor
+
+    @classmethod
+    def parse(cls, path: Path) -> "ModelConfig":
+        config = json.loads(path.read_text())
+        try:
+            upscaling_factor = int(config["image_size"] / config["input_image_size"])
+        except Exception:
+            upscaling_factor = None
+        return cls(path, config, upscaling_factor=upscaling_factor)
+
+
+class ConfigIndex:
+    """
+    Resolves the config .json of checkpoints under root without walking the models folder:
+
+        0 - a .json next to the checkpoint with the same name (without extension)
+        1 - a 'config.json' next to the checkpoint
+        2 - a 'config.json' in root
+
+    Only the checkpoint's folder and root can hold its config, so the index keeps the .json files of
+    each folder it was asked about, listed once and again only when the folder's mtime changes (a
+    file was added, removed or renamed in it). Parsed configs are kept per (mtime, size) of their
+    file, so a model switch costs a few stat calls.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.folders: dict[Path, tuple[int, dict[str, Path]]] = {}  # folder -> (mtime, lower stem -> .json path)
+        self.configs: dict[Path, tuple[tuple[int, int], ModelConfig]] = {}  # .json path -> ((mtime, size), config)
+        self.lock = threading.Lock()
+
+    def json_files(self, folder: Path) -> dict[str, Path]:
+        try:
+            mtime = os.stat(folder).st_mtime_ns
+        except OSError:
+            return {}
+
+        cached = self.folders.get(folder)
+        if cached is None or cached[0] != mtime:
+            files = {}
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.name.lower().endswith(".json") and entry.is_file():
+                        files.setdefault(Path(entry.name).stem.lower(), Path(entry.path))
+            cached = self.folders[folder] = (mtime, files)
+        return cached[1]
+
+    def resolve(self, model_path) -> tuple[Optional[Path], bool]:
+        # (config path or None, whether it is the root fallback)
+        model_path = Path(model_path)
+        siblings = self.json_files(model_path.parent)
+        for stem in (model_path.stem.lower(), "config"):
+            if stem in siblings:
+                return siblings[stem], False
+
+        path = self.json_files(self.root).get("config")
+        return path, path is not None
+
+    def get(self, model_path) -> Optional[ModelConfig]:
+        with self.lock:
+            path, fallback = self.resolve(model_path)
+            if path is None:
+                return None
+
+            stat = os.stat(path)
+            version = (stat.st_mtime_ns, stat.st_size)
+            cached = self.configs.get(path)
+            if cached is None or cached[0] != version:
+                cached = self.configs[path] = (version, ModelConfig.parse(path))
+
+        model_config = cached[1]
+        # the caller gets its own config dict, the cached one is shared by every model using that file
+        return ModelConfig(path, copy.deepcopy(model_config.config), fallback, model_config.upscaling_factor)
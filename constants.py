@@ -0,0 +1,26 @@
+# Options shared by the model code and the node definitions. Kept apart from aura_sr.py so that
+# registering the nodes does not import the model code and its dependencies.
+import torch
+
+
+# how AdaptiveConv2DMod applies the style:
+# 'weight' - modulates/demodulates a kernel per sample and runs one grouped conv (stylegan2)
+# 'activation' - scales the input activations and the conv outputs, runs a plain batched conv
+CONV_MODES = ("weight", "activation")
+
+# how the attention layers run:
+# 'sdpa' - torch's fused scaled_dot_product_attention kernels
+# 'math' - the whole similarity matrix, softmax and aggregation as separate ops
+# 'chunked' - blocks of queries (and keys, with an online softmax), the linear attention layers blocks
+#   of tiles, so the memory they take is bounded whatever the tile batch or tile size
+ATTENTION_BACKENDS = ("sdpa", "math", "chunked")
+
+# AuraSR.upscale modes, also the options of the node
+UPSCALE_MODES = ("4x", "4x_overlapped_checkboard", "4x_overlapped_constant", "4x_overlapped_seams")
+
+# AuraSR precisions: the weights, activations and tile buffers are kept in that dtype, the
+# numerically sensitive parts (demodulation norms, RMSNorm, softmax) always run in fp32
+PRECISIONS = {"fp32": torch.float32, "bf16": torch.bfloat16, "fp16": torch.float16}
+
+# the modes AuraSR.upscale_to_file can run band by band
+STREAMING_MODES = ("4x", "4x_overlapped_checkboard", "4x_overlapped_constant")
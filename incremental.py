@@ -0,0 +1,152 @@
+from typing import Hashable, List, Optional
+
+import torch
+import torch.nn.functional as F
+from torch import Tensor
+
+from .aura_sr import TileGrid, SeamGrid, UpscaleJob, create_blend_weights, tile_view
+
+
+def changed_tiles(previous: Tensor, current: Tensor, tile_size: int) -> Tensor:
+    # flat indices of the tiles that differ in any value between two padded (c, h, w) images
+    changed = (tile_view(previous, tile_size) != tile_view(current, tile_size)).flatten(2).any(2)
+    return torch.nonzero(changed.flatten()).flatten()
+
+
+class ImageState:
+    """
+    One image of the previous run: the padded input of each of its grids, the canvases the model
+    outputs of their tiles were written into (blended, for the overlapped modes) and, in the seam
+    mode, which offset tiles have an output in their canvas.
+    """
+
+    def __init__(self, inputs: List[Tensor], canvases: List[Tensor], ran: Optional[Tensor] = None):
+        self.inputs = inputs
+        self.canvases = canvases
+        self.ran = ran
+
+
+class UpscaleSession:
+    """
+    Keeps the previous run of AuraSR.upscale so the next one only runs the tiles whose input changed,
+    e.g. when a small region of the image was edited. The new input is compared tile by tile with the
+    kept one (for both grids of the overlapped modes), the changed tiles are run into the kept canvases
+    and the output is put together again from them: the neighbouring tiles, whose blend or seam
+    feathering overlaps the changed ones, are blended again from their kept outputs instead of being run.
+
+    The result is the same as a full run's, since with a fixed style the output of a tile only depends
+    on its input. Any other change (model, mode, style seed, dtype, image size) starts over.
+    """
+
+    def __init__(self, model: Optional[Hashable] = None):
+        self.model = model  # what produced the kept outputs, for the owner to tell models apart
+        self.signature = None
+        self.states: List[Optional[ImageState]] = []
+        self.tiles_run = 0
+
+    def start(self, signature: Hashable, images: int):
+        if signature != self.signature:
+            self.signature = signature
+            self.states = []
+        self.states = (self.states + [None] * images)[:images]
+        self.tiles_run = 0
+
+    def clear(self):
+        self.signature = None
+        self.states = []
+
+
+class SeamPatchGrid(TileGrid):
+    # the offset tiles of the seam mode, run into their own canvas: the ones selected once the base
+    # pass is in (see SeamGrid) that have no kept output for their current input
+    def __init__(self, image: Tensor, tile_size: int, output: Tensor, seams: SeamGrid, ran: Tensor, base: Tensor):
+        super().__init__(image, tile_size, output=output)
+        self.seams = seams
+        self.ran = ran
+        self.base = base
+
+    def prepare(self):
+        self.seams.output.copy_(self.base)
+        self.seams.prepare()
+        selected = self.seams.indices
+        self.select(selected[~self.ran[selected]])
+
+
+def incremental_job(aura_sr, session: UpscaleSession, index: int, image_tensor: Tensor, mode: str, out: Tensor, seam_overlap=64, seam_threshold=0.0) -> UpscaleJob:
+    # like AuraSR.make_job, for image index of the session's batch, writing its (h * 4, w * 4, c) output into out
+    with aura_sr.profile("tiling"):
+        tile_size = aura_sr.input_image_size
+        offset_4x = tile_size // 2 * 4
+        _, h, w = image_tensor.shape
+
+        inputs = [aura_sr.pad_to_tiles(image_tensor)]
+        if mode != "4x":
+            offset = tile_size // 2
+            inputs.append(F.pad(inputs[0], (offset, offset, offset, offset), mode='reflect'))
+
+        # the state only goes back into the session once the job is complete, a failed run leaves none
+        state = session.states[index]
+        session.states[index] = None
+        if state is not None and [x.shape for x in state.inputs] != [x.shape for x in inputs]:
+            state = None
+
+        if state is None:
+            _, ph, pw = inputs[-1].shape
+            canvases = [torch.zeros((3, ph * 4, pw * 4), dtype=torch.float32) for _ in inputs]
+            changed = [torch.arange((x.shape[1] // tile_size) * (x.shape[2] // tile_size)) for x in inputs]
+        else:
+            canvases = state.canvases
+            changed = [changed_tiles(previous, current, tile_size) for previous, current in zip(state.inputs, inputs)]
+
+        # the base grid writes into the interior of its canvas, as in make_job
+        base_output = canvases[0] if mode == "4x" else canvases[0][:, offset_4x:-offset_4x, offset_4x:-offset_4x]
+        ran = None
+
+        if mode == "4x":
+            grids = [TileGrid(inputs[0], tile_size, output=base_output)]
+            grids[0].select(changed[0])
+            passes = [grids]
+        elif mode == "4x_overlapped_seams":
+            ran = state.ran if state is not None else torch.zeros(len(changed[1]), dtype=torch.bool)
+            ran[changed[1]] = False
+            seams = SeamGrid(inputs[1], tile_size, torch.empty_like(canvases[0]), seam_overlap=seam_overlap, seam_threshold=seam_threshold)
+            grids = [
+                TileGrid(inputs[0], tile_size, output=base_output),
+                SeamPatchGrid(inputs[1], tile_size, canvases[1], seams, ran, canvases[0]),
+            ]
+            grids[0].select(changed[0])
+            passes = [[grid] for grid in grids]
+        else:
+            # each grid keeps its blended tiles in its own canvas, the output is their sum
+            blend = create_blend_weights(tile_size * 4, mode.rsplit("_", 1)[-1])
+            grids = [
+                TileGrid(inputs[0], tile_size, output=base_output, blend=blend),
+                TileGrid(inputs[1], tile_size, output=canvases[1], blend=blend),
+            ]
+            for grid, indices in zip(grids, changed):
+                rows, cols = grid.positions(indices)
+                grid.output_tiles[rows, cols] = 0
+                grid.select(indices)
+            passes = [grids]
+
+    def finish(job):
+        session.tiles_run += sum(len(grid.indices) for grid in grids)
+
+        with aura_sr.profile("convert_output"):
+            if mode == "4x":
+                out.copy_(canvases[0][:, :h * 4, :w * 4].permute(1, 2, 0))
+            elif mode == "4x_overlapped_seams":
+                # the kept base pass, feathered with the selected offset tiles
+                patch = grids[1]
+                ran[patch.indices] = True
+                selected = seams.indices
+                rows, cols = seams.positions(selected)
+                seams.write(selected, tile_view(canvases[1], tile_size * 4)[rows, cols])
+                out.copy_(seams.output[:, offset_4x:offset_4x + h * 4, offset_4x:offset_4x + w * 4].permute(1, 2, 0))
+            else:
+                crop = (slice(None), slice(offset_4x, offset_4x + h * 4), slice(offset_4x, offset_4x + w * 4))
+                torch.add(canvases[0][crop], canvases[1][crop], out=out.permute(2, 0, 1))
+
+        session.states[index] = ImageState(inputs, canvases, ran)
+
+    return UpscaleJob(passes, finish)
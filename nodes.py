@@ -1,145 +1,178 @@
 import os
-from pathlib import Path
 import json
+import uuid
+from pathlib import Path
 import folder_paths
 from comfy import model_management
 import comfy.utils
-from .aura_sr import AuraSR
+from .constants import ATTENTION_BACKENDS, STREAMING_MODES, PRECISIONS
+from .streaming import ROW_WRITERS
+from .autotune import auto_batch_size
+from .registry import ModelEntry, model_registry
+from .config_index import ConfigIndex
+from .profiling import Profiler, module_profiling_enabled, profile_stage, profiling_enabled
+from .result_cache import ResultCache, tensor_hash
 from .utils import *
 
+# the model code (aura_sr.py, onnx_engine.py) and its dependencies are only imported when a node first runs,
+# and the model folder is only looked up when the nodes are first listed, to keep ComfyUI's startup fast
 
-if "aura-sr" not in folder_paths.folder_names_and_paths:
-    aurasr_folders = [p for p in os.listdir(folder_paths.models_dir) if os.path.isdir(os.path.join(folder_paths.models_dir, p)) and (p.lower() == "aura-sr" or p.lower() == "aurasr" or p.lower() == "aura_sr")]
-    aurasr_fullpath = os.path.join(folder_paths.models_dir, aurasr_folders[0]) if len(aurasr_folders) > 0 else os.path.join(folder_paths.models_dir, "Aura-SR")
-    if not os.path.isdir(aurasr_fullpath):
-        os.mkdir(aurasr_fullpath)
-
-    folder_paths.folder_names_and_paths["aura-sr"] = ([aurasr_fullpath], folder_paths.supported_pt_extensions)
-else:
-    aurasr_fullpath = folder_paths.folder_names_and_paths["aura-sr"][0][0]
-    folder_paths.folder_names_and_paths.pop('aura-sr', None)
-    folder_paths.folder_names_and_paths["aura-sr"] = ([aurasr_fullpath], folder_paths.supported_pt_extensions)
-
-
-
-AuraSRUpscalers = []
-
-
-def get_config(model_path):
-    configs = [f for f in Path(aurasr_fullpath).rglob('*') if f.is_file() and f.name.lower().endswith(".json")]
-    # picking rules by priority (exit immediately when picked):
-    # 0 - if a config file is at the same location of the model AND has the same name (without ext)
-    # 1 - if a config file is at the same location of the model AND is named 'config' (without ext)
-    # 2 - if a config file is at aurasr_fullpath and is named 'config' (without ext)
-    #   -- notify user for potential invalid config.json when case #2
-    rule = 0
-    while (rule < 3):
-        for c in configs: 
-            if rule == 0 and c.parent == Path(model_path).parent and c.stem.lower() == Path(model_path).stem.lower():
-                return json.loads(c.read_text())
-            if rule == 1 and c.parent == Path(model_path).parent and c.stem.lower() == "config":
-                return json.loads(c.read_text())
-            if rule == 2 and str(c.parent) == aurasr_fullpath and c.stem.lower() == "config":
-                print(f"\n[AuraSR-ComfyUI] WARNING:\n\tCould not find a config named 'config.json'/modelname.json for model: '\\{c.parent.name}\\{Path(model_path).parent.name}\\{Path(model_path).name}'")
-                print(f"\tUsing '\\{c.parent.name}\\{c.name}' instead.")
-                print("\tIf this configuration is not intended for this model then it can cause errors or quality loss in the output!!\n")
-                return json.loads(c.read_text())
-        rule += 1
-    return None
-
-
-def getAuraClassFromMemory(model_name):
-    i = 0
-    while (i < len(AuraSRUpscalers)):
-        if model_name == AuraSRUpscalers[i].model_name:
-            if not AuraSRUpscalers[i].loaded: # remove if model not loaded
-                AuraSRUpscalers[i].unload()
-                AuraSRUpscalers.pop(i)
-            else:
-                return AuraSRUpscalers[i]
-        i += 1
-    return None
+
+aurasr_fullpath = None
+
+def model_folder():
+    # registers the 'aura-sr' model folder on first use, returns its path
+    global aurasr_fullpath
+    if aurasr_fullpath is not None:
+        return aurasr_fullpath
+    
+    if "aura-sr" not in folder_paths.folder_names_and_paths:
+        aurasr_folders = [p for p in os.listdir(folder_paths.models_dir) if os.path.isdir(os.path.join(folder_paths.models_dir, p)) and (p.lower() == "aura-sr" or p.lower() == "aurasr" or p.lower() == "aura_sr")]
+        aurasr_fullpath = os.path.join(folder_paths.models_dir, aurasr_folders[0]) if len(aurasr_folders) > 0 else os.path.join(folder_paths.models_dir, "Aura-SR")
+        if not os.path.isdir(aurasr_fullpath):
+            os.mkdir(aurasr_fullpath)
+
+        folder_paths.folder_names_and_paths["aura-sr"] = ([aurasr_fullpath], folder_paths.supported_pt_extensions)
+    else:
+        aurasr_fullpath = folder_paths.folder_names_and_paths["aura-sr"][0][0]
+        folder_paths.folder_names_and_paths.pop('aura-sr', None)
+        folder_paths.folder_names_and_paths["aura-sr"] = ([aurasr_fullpath], folder_paths.supported_pt_extensions)
+    return aurasr_fullpath
+
+
+def model_names():
+    model_folder()
+    return folder_paths.get_filename_list("aura-sr")
+
+
+def batch_size_profiles():
+    # calibrated tile_batch_size per (device, model config, dtype), see autotune.py
+    return os.path.join(model_folder(), ".cache", "batch_size_profiles.json")
+
+
+def result_cache_folder():
+    # upscaled images kept between runs, see result_cache.py
+    return os.path.join(model_folder(), ".cache", "results")
+
+
+# checkpoint -> resolved config, see config_index.py for the picking rules
+config_index = None
+
+
+def get_config(model_path, warn=True):
+    global config_index
+    if config_index is None:
+        config_index = ConfigIndex(model_folder())
+    model_config = config_index.get(model_path)
+    if warn and model_config is not None and model_config.fallback:
+        # notify user for potential invalid config.json when picked from aurasr_fullpath
+        c = model_config.path
+        print(f"\n[AuraSR-ComfyUI] WARNING:\n\tCould not find a config named 'config.json'/modelname.json for model: '\\{c.parent.name}\\{Path(model_path).parent.name}\\{Path(model_path).name}'")
+        print(f"\tUsing '\\{c.parent.name}\\{c.name}' instead.")
+        print("\tIf this configuration is not intended for this model then it can cause errors or quality loss in the output!!\n")
+    return model_config
+
+
+def model_key(model_path, device, precision="fp32", cpu_int8=False, backend="torch"):
+    # registry key: the weights are kept at the precision they run at, so each precision (and the int8
+    # and onnxruntime engines) is its own model in memory
+    dtype = "onnx" if backend == "onnxruntime" else "int8" if cpu_int8 else precision
+    return (os.path.abspath(model_path), str(device), dtype)
+
+
+def load_aura_sr(model_path, config, device, precision="fp32"):
+    # .safetensors are memory-mapped into a model built without initialisation (see AuraSR.from_checkpoint),
+    # other checkpoint formats are read whole by ComfyUI and copied into a regular model
+    from .aura_sr import AuraSR
+    if model_path.lower().endswith(".safetensors"):
+        return AuraSR.from_checkpoint(config, model_path, device=device, precision=precision)
+    checkpoint = comfy.utils.load_torch_file(model_path, safe_load=True)
+    aura_sr = AuraSR(config=config, device=device, precision=precision)
+    aura_sr.upsampler.load_state_dict(checkpoint, strict=True)
+    return aura_sr
 
 
 class AuraSRUpscaler:
     @classmethod
     def INPUT_TYPES(s):
-        return {"required": {"model_name": (folder_paths.get_filename_list("aura-sr"),),
+        return {"required": {"model_name": (model_names(),),
                              "image": ("IMAGE",),
-                             "mode": (["4x", "4x_overlapped_checkboard", "4x_overlapped_constant"],),
+                             "mode": (["4x", "4x_overlapped_checkboard", "4x_overlapped_constant", "4x_overlapped_seams"],),
                              "reapply_transparency": ("BOOLEAN", {"default": True}),
-                             "tile_batch_size": ("INT", {"default": 8, "min": 1, "max": 32}),
+                             "tile_batch_size": ("INT", {"default": 8, "min": 0, "max": 32}),
                              "device": (["default", "cpu"],),
                              "offload_to_cpu": ("BOOLEAN", {"default": False}),
             },
             "optional": {
                 "transparency_mask": ("MASK",),
+                "style_seed": ("INT", {"default": -1, "min": -1, "max": 0xffffffffffffffff}),
+                "pool_tiles": ("BOOLEAN", {"default": True}),
+                "seam_overlap": ("INT", {"default": 64, "min": 2, "max": 256, "step": 2}),
+                "seam_threshold": ("FLOAT", {"default": 0.0, "min": 0.0, "max": 10.0, "step": 0.1}),
+                "precision": (list(PRECISIONS),),
+                "cpu_int8": ("BOOLEAN", {"default": False}),
+                "compile": ("BOOLEAN", {"default": False}),
+                "backend": (["torch", "onnxruntime"],),
+                "channels_last": ("BOOLEAN", {"default": False}),
+                "attention": (["default", *ATTENTION_BACKENDS],),
+                "profile": ("BOOLEAN", {"default": False}),
+                "tile_cache_mb": ("INT", {"default": 0, "min": 0, "max": 65536, "step": 64}),
+                "result_cache_mb": ("INT", {"default": 0, "min": 0, "max": 1048576, "step": 256}),
+                "incremental": ("BOOLEAN", {"default": False}),
             },
         }
     
-    RETURN_TYPES = ("IMAGE",)
+    RETURN_TYPES = ("IMAGE", "STRING")
+    RETURN_NAMES = ("IMAGE", "performance_report")
     FUNCTION = "main"
 
     CATEGORY = "AuraSR"
     
     def __init__(self):
-        self.loaded = False
-        self.model_name = ""
+        self.entry = None
         self.aura_sr = None
         self.upscaling_factor = 4
         self.device_warned = False
         self.config = None
         self.device = "cpu"
+        self.session = None
     
     
-    def unload(self):
-        if self.aura_sr is not None:
-            self.aura_sr.upsampler = None  # I don't know if this is the best way to unload a model but it should work
-        self.aura_sr = None
-        self.loaded = False
-        self.model_name = ""
-        self.upscaling_factor = 4
-        self.config = None
-        self.device = "cpu"
-    
-    
-    def load(self, model_name, device):
-        model_path = folder_paths.get_full_path("aura-sr", model_name)
-        self.config = get_config(model_path)
-        if self.config is None:
-            return
+    def load(self, model_path, key, device, precision="fp32", cpu_int8=False, backend="torch"):
+        # builds the registry entry of a model that is not resident yet, None without a config
+        model_name = os.path.basename(model_path)
+        model_config = get_config(model_path)
+        if model_config is None:
+            return None
+        config = model_config.config
         
-        try:
-            self.upscaling_factor = int(self.config["image_size"] / self.config["input_image_size"])
-        except:
+        upscaling_factor = model_config.upscaling_factor
+        if upscaling_factor is None:
             print(f"[AuraSR-ComfyUI] Failed to calculate {model_name}'s upscaling factor. Defaulting to 4.")
-            self.upscaling_factor = 4
+            upscaling_factor = 4
         
-        checkpoint = comfy.utils.load_torch_file(model_path, safe_load=True)
+        if backend == "onnxruntime":
+            from .onnx_engine import OnnxAuraSR, export_onnx, onnx_model_path
+            # exported once per checkpoint, next to it
+            onnx_path = onnx_model_path(model_path)
+            if not onnx_path.exists():
+                print(f"[AuraSR-ComfyUI] Exporting {model_name} to ONNX, only done once...")
+                aura_sr = load_aura_sr(model_path, config, "cpu")
+                export_onnx(aura_sr.upsampler, onnx_path)
+                del aura_sr
+            onnx_files = [onnx_path, onnx_path.with_name(onnx_path.name + ".data")]
+            size = sum(os.path.getsize(p) for p in onnx_files if p.exists())
+            return ModelEntry(key, OnnxAuraSR(config, onnx_path), config, upscaling_factor, size=size)
         
-        self.aura_sr = AuraSR(config=self.config, device=device)
-        self.aura_sr.upsampler.load_state_dict(checkpoint, strict=True)
-        
-        self.loaded = True
-        self.model_name = model_name
-        self.device = device
-    
-    
-    def load_from_memory(self, cl, device):
-        self.loaded = True
-        self.model_name = cl.model_name
-        self.aura_sr = cl.aura_sr
-        self.upscaling_factor = cl.upscaling_factor
-        self.device_warned = cl.device_warned
-        self.config = cl.config
-        if device != cl.device:
-            self.aura_sr.upsampler.to(device)
-            cl.device = device
-        self.device = device
-    
+        aura_sr = load_aura_sr(model_path, config, device, precision)
+        if cpu_int8:
+            aura_sr.quantize()
+        return ModelEntry(key, aura_sr, config, upscaling_factor)
     
     
-    def main(self, model_name, image, mode, reapply_transparency, tile_batch_size, device, offload_to_cpu, transparency_mask=None):
+    def load_model(self, model_name, device, precision="fp32", cpu_int8=False, backend="torch"):
+        # resolves the device and acquires the model on it from the registry, returns (device, entry)
+        # the entry is None when the model has no config, otherwise it must be given back with release()
         
         # set device
         torch_device = model_management.get_torch_device()
@@ -152,84 +185,300 @@ class AuraSRUpscaler:
             device = torch_device if device == "default" else "cpu"
             device = device if str(device).lower() != "cpu" else "cpu" # force device to be "cpu" when using CPU in default mode
         
-        # load/unload model
-        class_in_memory = getAuraClassFromMemory(model_name)
-        if not self.loaded or self.model_name != model_name:
-            
-            if class_in_memory is None:
-                self.unload()
-                self.load(model_name, device)
-                AuraSRUpscalers.append(self)
+        # onnxruntime runs the exported fp32 graph on the CPU
+        if backend == "onnxruntime":
+            from .onnx_engine import onnx_available
+            if not onnx_available():
+                print("[AuraSR-ComfyUI] The onnxruntime backend needs the 'onnx' and 'onnxruntime' packages. Using torch instead.")
+                backend = "torch"
             else:
-                self.load_from_memory(class_in_memory, device)
-            
-            if self.config is None:
-                print("[AuraSR-ComfyUI] Could not find a config/ModelName .json file! Please download it from the model's HF page and place it according to the instructions (https://github.com/GreenLandisaLie/AuraSR-ComfyUI?tab=readme-ov-file#instructions).\nReturning original image.")
-                return (image, )
-        else:
-            if self.device != device:
-                self.aura_sr.upsampler.to(device)
-                self.device = device
-                if class_in_memory is not None:
-                    class_in_memory.device = device
+                device, precision, cpu_int8 = "cpu", "fp32", False
         
+        # the int8 engine only runs fp32 models on the CPU
+        if cpu_int8 and (device != "cpu" or precision != "fp32"):
+            print("[AuraSR-ComfyUI] cpu_int8 needs device 'cpu' and precision 'fp32'. Running without it.")
+            cpu_int8 = False
         
-        # iterate through images input
-        upscaled_images = []
+        model_folder()
+        model_path = folder_paths.get_full_path("aura-sr", model_name)
+        key = model_key(model_path, device, precision, cpu_int8, backend)
+        entry = model_registry.acquire(key, lambda: self.load(model_path, key, device, precision, cpu_int8, backend), expected_size=os.path.getsize(model_path))
+        
+        self.entry = entry
+        self.aura_sr = entry.aura_sr if entry is not None else None
+        self.config = entry.config if entry is not None else None
+        self.upscaling_factor = entry.upscaling_factor if entry is not None else 4
+        self.device = device
+        return device, entry
+    
+    
+    def release(self, entry, offload_to_cpu=False, failed=False):
+        # ends a run: the node does not keep the model alive, the registry decides what stays resident
+        if offload_to_cpu:
+            model_registry.offload(entry)
+        model_registry.release(entry)
+        # force unload when inference fails
+        if failed:
+            model_registry.discard(entry)
+        self.entry = None
+        self.aura_sr = None
+    
+    
+    def set_tile_cache(self, tile_cache_mb, style_seed):
+        # the cache belongs to the model, so it is shared by the nodes using it and kept between runs
+        if tile_cache_mb > 0 and style_seed is None:
+            print("[AuraSR-ComfyUI] tile_cache_mb needs a fixed style_seed (>= 0), running without the tile cache.")
+        self.aura_sr.set_tile_cache(tile_cache_mb)
+    
+    
+    def report_tile_cache(self):
+        report = (self.aura_sr.last_schedule_report or {}).get("tile_cache")
+        if report is not None:
+            print(f"[AuraSR-ComfyUI] Tile cache: {report['reused']} of {report['lookups']} tiles reused ({report['hit_rate']:.0%}).")
+    
+    
+    def result_cache(self, result_cache_mb, model_name, image, mode, style_seed, **options):
+        # (cache, key) of the upscaled image, key is None when results are not cached
+        # only a fixed style is reproducible, the model is identified by the hash of its file
+        if result_cache_mb <= 0:
+            return None, None
+        if style_seed is None:
+            print("[AuraSR-ComfyUI] result_cache_mb needs a fixed style_seed (>= 0), running without the result cache.")
+            return None, None
+        model_folder()
+        model_path = folder_paths.get_full_path("aura-sr", model_name)
+        model_config = get_config(model_path, warn=False) if model_path is not None else None
+        if model_config is None:
+            return None, None
+        
+        result_cache = ResultCache(result_cache_folder(), result_cache_mb << 20)
+        key = ResultCache.key(
+            image=tensor_hash(image), shape=list(image.shape), model=result_cache.model_hash(model_path), config=model_config.config,
+            mode=mode, tile_size=model_config.config["input_image_size"], style_seed=style_seed, **options,
+        )
+        return result_cache, key
+    
+    
+    def store_result(self, result_cache, key, output):
+        if key is None:
+            return
+        try:
+            result_cache.put(key, output)
+        except Exception as e:
+            print(f"[AuraSR-ComfyUI] Could not store the result in the result cache ({e}).")
+    
+    
+    def upscale_session(self, incremental, style_seed):
+        # the previous run of this node, kept to only redo the tiles that changed (see incremental.py)
+        # as long as the model is the same, None runs a full upscale and drops it
+        if incremental and style_seed is None:
+            print("[AuraSR-ComfyUI] incremental needs a fixed style_seed (>= 0), running a full upscale.")
+        if not incremental or style_seed is None:
+            self.session = None
+            return None
+        from .incremental import UpscaleSession
+        if self.session is None or self.session.model != self.entry.key:
+            self.session = UpscaleSession(self.entry.key)
+        return self.session
+    
+    
+    def report_session(self, session):
+        if session is not None:
+            print(f"[AuraSR-ComfyUI] Incremental upscale: ran {session.tiles_run} tiles, reused the rest of the previous output.")
+    
+    
+    def start_profile(self, profile, **info):
+        # a Profiler for this run when profiling is on (node toggle or AURASR_PROFILE), otherwise None
+        if not profiling_enabled(profile):
+            return None
+        profiler = Profiler(modules=module_profiling_enabled())
+        profiler.info.update(run_id=uuid.uuid4().hex[:12], node=type(self).__name__, **info)
+        return profiler
+    
+    
+    def attach_profiler(self, profiler, device, **info):
+        if profiler is None:
+            return
+        profiler.set_device(device)
+        profiler.info.update(device=str(device), **info)
+        self.aura_sr.profiler = profiler
+        profiler.attach(self.aura_sr)
+    
+    
+    def finish_profile(self, profiler):
+        # detaches the profiler and logs its report, returns it as the node's performance_report output
+        if profiler is None:
+            return ""
+        profiler.detach()
+        if self.aura_sr is not None:
+            self.aura_sr.profiler = None
+            profiler.scheduler = self.aura_sr.last_schedule_report
+        report = profiler.report()
+        profiler.log(report)
+        return json.dumps(report, indent=2)
+    
+    
+    def resolve_batch_size(self, tile_batch_size):
+        # 0 - auto: calibrated once per device/model/dtype, smaller when free memory runs low
+        if tile_batch_size > 0:
+            return tile_batch_size
+        try:
+            free_memory = model_management.get_free_memory(torch.device(self.device))
+        except:
+            free_memory = None
+        return auto_batch_size(self.aura_sr, batch_size_profiles(), free_memory)
+    
+    
+    def main(self, model_name, image, mode, reapply_transparency, tile_batch_size, device, offload_to_cpu, transparency_mask=None, style_seed=-1, pool_tiles=True, seam_overlap=64, seam_threshold=0.0, precision="fp32", cpu_int8=False, compile=False, backend="torch", channels_last=False, profile=False, tile_cache_mb=0, result_cache_mb=0, incremental=False, attention="default"):
+        
+        profiler = self.start_profile(profile, model=model_name, mode=mode, images=len(image), size=list(image.shape[1:3]))
+        
+        # a negative seed keeps drawing a random style for every tile batch
+        style_seed = style_seed if style_seed >= 0 else None
         reapply_transparency = reapply_transparency if len(image) == 1 else False
-        for tensor_image in image:
         
-            # prepare input image and resized_alpha
-            input_image, resized_alpha = prepare_input(tensor_image if len(image) != 1 else image, transparency_mask, reapply_transparency, self.upscaling_factor)
-            
-            # upscale
-            inference_failed = False
-            try:
-                if mode == "4x":
-                    upscaled_image = self.aura_sr.upscale_4x(image=input_image, max_batch_size=tile_batch_size)
-                elif mode == "4x_overlapped_checkboard":
-                    upscaled_image = self.aura_sr.upscale_4x_overlapped(image=input_image, max_batch_size=tile_batch_size, weight_type='checkboard')
-                else:
-                    upscaled_image = self.aura_sr.upscale_4x_overlapped(image=input_image, max_batch_size=tile_batch_size, weight_type='constant') 
-            except:
-                inference_failed = True
-                print("[AuraSR-ComfyUI] Failed to upscale with AuraSR. Returning original image.")
-                upscaled_image = input_image
-            
-            # apply resized_alpha
-            if reapply_transparency and resized_alpha is not None:
+        # a stored result of the same image, model and settings is returned without loading the model
+        with profile_stage(profiler, "result_cache"):
+            result_cache, result_key = self.result_cache(result_cache_mb, model_name, image, mode, style_seed, precision=precision, cpu_int8=cpu_int8, backend=backend, seam_overlap=seam_overlap, seam_threshold=seam_threshold, attention=attention)
+            output = result_cache.get(result_key) if result_key is not None else None
+        if output is not None:
+            print("[AuraSR-ComfyUI] Result cache: returning the stored upscale of this image.")
+            if reapply_transparency:
                 try:
-                    upscaled_image = paste_alpha(upscaled_image, resized_alpha)
+                    with profile_stage(profiler, "apply_alpha"):
+                        resized_alpha = get_resized_alpha(image, transparency_mask, output.shape[1] // image.shape[1])
+                        output = paste_alpha_tensor(output, resized_alpha) if resized_alpha is not None else output
                 except:
                     print("[AuraSR-ComfyUI] Failed to apply alpha layer.")
-            
-            # back to tensor and add to list
-            upscaled_images.append(pil2tensor(upscaled_image))
+            return (output, self.finish_profile(profiler))
         
+        with profile_stage(profiler, "load_model"):
+            device, entry = self.load_model(model_name, device, precision, cpu_int8, backend)
+        if entry is None:
+            print("[AuraSR-ComfyUI] Could not find a config/ModelName .json file! Please download it from the model's HF page and place it according to the instructions (https://github.com/GreenLandisaLie/AuraSR-ComfyUI?tab=readme-ov-file#instructions).\nReturning original image.")
+            return (image, "")
         
-        # create output tensor from list of tensors
-        output = torch.cat(upscaled_images, dim=0)
         
-        # offload to cpu
-        if offload_to_cpu:
-            self.aura_sr.upsampler.to("cpu")
-            self.device = "cpu"
-            if class_in_memory is not None:
-                class_in_memory.device = "cpu"
+        # prepare resized_alpha
+        with profile_stage(profiler, "prepare_input"):
+            resized_alpha = get_resized_alpha(image, transparency_mask, self.upscaling_factor) if reapply_transparency else None
         
-        # force unload when inference fails
-        if inference_failed:
-            self.unload()
+        # upscale - stays in torch from the input IMAGE batch to the output one
+        inference_failed = False
+        try:
+            tile_batch_size = self.resolve_batch_size(tile_batch_size)
+            self.aura_sr.compile(compile)
+            self.aura_sr.set_channels_last(channels_last)
+            self.aura_sr.set_attention_backend(None if attention == "default" else attention)
+            self.set_tile_cache(tile_cache_mb, style_seed)
+            session = self.upscale_session(incremental, style_seed)
+            self.attach_profiler(profiler, device, tile_batch_size=tile_batch_size, precision=precision, backend=backend)
+            with profile_stage(profiler, "upscale"):
+                output = self.aura_sr.upscale(image, mode=mode, max_batch_size=tile_batch_size, style_seed=style_seed, pool_tiles=pool_tiles, seam_overlap=seam_overlap, seam_threshold=seam_threshold, session=session)
+            self.report_tile_cache()
+            self.report_session(session)
+            with profile_stage(profiler, "result_cache"):
+                self.store_result(result_cache, result_key, output)
+        except:
+            inference_failed = True
+            print("[AuraSR-ComfyUI] Failed to upscale with AuraSR. Returning original image.")
+            output = image
+            self.session = None
+        
+        # apply resized_alpha
+        if resized_alpha is not None and not inference_failed:
+            try:
+                with profile_stage(profiler, "apply_alpha"):
+                    output = paste_alpha_tensor(output, resized_alpha)
+            except:
+                print("[AuraSR-ComfyUI] Failed to apply alpha layer.")
+        
+        report = self.finish_profile(profiler)
+        self.release(entry, offload_to_cpu, inference_failed)
+        
+        return (output, report)
+
+
+
+class AuraSRUpscalerToFile(AuraSRUpscaler):
+    # Streams the upscaled image straight to a file in the output folder, band by band, instead of
+    # returning an IMAGE: for upscales whose output would not fit in memory (e.g. 6000x4000 -> 24000x16000)
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required": {"model_name": (model_names(),),
+                             "image": ("IMAGE",),
+                             "mode": (list(STREAMING_MODES),),
+                             "tile_batch_size": ("INT", {"default": 8, "min": 0, "max": 32}),
+                             "device": (["default", "cpu"],),
+                             "offload_to_cpu": ("BOOLEAN", {"default": False}),
+                             "filename_prefix": ("STRING", {"default": "AuraSR"}),
+                             "format": (list(ROW_WRITERS),),
+            },
+            "optional": {
+                "style_seed": ("INT", {"default": -1, "min": -1, "max": 0xffffffffffffffff}),
+                "precision": (list(PRECISIONS),),
+                "cpu_int8": ("BOOLEAN", {"default": False}),
+                "compile": ("BOOLEAN", {"default": False}),
+                "backend": (["torch", "onnxruntime"],),
+                "channels_last": ("BOOLEAN", {"default": False}),
+                "attention": (["default", *ATTENTION_BACKENDS],),
+                "profile": ("BOOLEAN", {"default": False}),
+                "tile_cache_mb": ("INT", {"default": 0, "min": 0, "max": 65536, "step": 64}),
+            },
+        }
+    
+    RETURN_TYPES = ("STRING", "STRING")
+    RETURN_NAMES = ("file_paths", "performance_report")
+    OUTPUT_NODE = True
+    
+    
+    def main(self, model_name, image, mode, tile_batch_size, device, offload_to_cpu, filename_prefix, format, style_seed=-1, precision="fp32", cpu_int8=False, compile=False, backend="torch", channels_last=False, profile=False, tile_cache_mb=0, attention="default"):
+        
+        profiler = self.start_profile(profile, model=model_name, mode=mode, images=len(image), size=list(image.shape[1:3]), format=format)
+        with profile_stage(profiler, "load_model"):
+            device, entry = self.load_model(model_name, device, precision, cpu_int8, backend)
+        if entry is None:
+            print("[AuraSR-ComfyUI] Could not find a config/ModelName .json file! Please download it from the model's HF page and place it according to the instructions (https://github.com/GreenLandisaLie/AuraSR-ComfyUI?tab=readme-ov-file#instructions).")
+            return ("", "")
+        
+        style_seed = style_seed if style_seed >= 0 else None
+        
+        paths = []
+        inference_failed = False
+        try:
+            # one file per image of the batch, named like the ones of the 'Save Image' node
+            _, h, w, _ = image.shape
+            full_output_folder, filename, counter, _, _ = folder_paths.get_save_image_path(filename_prefix, folder_paths.get_output_directory(), w * self.upscaling_factor, h * self.upscaling_factor)
+            
+            tile_batch_size = self.resolve_batch_size(tile_batch_size)
+            self.aura_sr.compile(compile)
+            self.aura_sr.set_channels_last(channels_last)
+            self.aura_sr.set_attention_backend(None if attention == "default" else attention)
+            self.set_tile_cache(tile_cache_mb, style_seed)
+            self.attach_profiler(profiler, device, tile_batch_size=tile_batch_size, precision=precision, backend=backend)
+            for i in range(len(image)):
+                path = os.path.join(full_output_folder, f"{filename}_{counter + i:05}_.{format}")
+                with profile_stage(profiler, "upscale"):
+                    paths.append(self.aura_sr.upscale_to_file(image[i], path, mode=mode, max_batch_size=tile_batch_size, style_seed=style_seed, format=format))
+                self.report_tile_cache()
+        except:
+            inference_failed = True
+            print("[AuraSR-ComfyUI] Failed to upscale with AuraSR.")
+        
+        report = self.finish_profile(profiler)
+        self.release(entry, offload_to_cpu, inference_failed)
         
-        return (output, )
+        return ("\n".join(paths), report)
 
 
 
 
 NODE_CLASS_MAPPINGS = {
-    "AuraSR.AuraSRUpscaler": AuraSRUpscaler
+    "AuraSR.AuraSRUpscaler": AuraSRUpscaler,
+    "AuraSR.AuraSRUpscalerToFile": AuraSRUpscalerToFile,
 }
 
 NODE_DISPLAY_NAME_MAPPINGS = {
-    "AuraSR.AuraSRUpscaler": "AuraSR Upscaler"
+    "AuraSR.AuraSRUpscaler": "AuraSR Upscaler",
+    "AuraSR.AuraSRUpscalerToFile": "AuraSR Upscaler (stream to file)",
 }
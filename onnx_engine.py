@@ -0,0 +1,160 @@
+import importlib.util
+import os
+import tempfile
+import warnings
+from pathlib import Path
+from typing import Any, Optional
+
+import torch
+from torch import nn, Tensor
+
+from .aura_sr import AuraSR, UnetUpsampler, exists, noise_augment, style_noise
+from .utils import file_hash
+
+
+# the exported graph takes (lowres, noise) - per tile style noise, run through the style network
+# in the graph - or (lowres, style) - a precomputed style vector, output of the style network
+EXPORT_INPUTS = ("noise", "style")
+
+OPSET_VERSION = 17
+
+
+def onnx_available() -> bool:
+    # both are optional dependencies, only needed for this engine
+    return all(importlib.util.find_spec(name) is not None for name in ("onnx", "onnxruntime"))
+
+
+class UnetExport(nn.Module):
+    # UnetUpsampler without its python-side parts (style cache, noise augmentation), as traced for export
+    def __init__(self, upsampler: UnetUpsampler, inputs: str = "noise"):
+        super().__init__()
+        assert inputs in EXPORT_INPUTS, f"inputs must be one of {EXPORT_INPUTS}"
+        self.upsampler = upsampler
+        self.inputs = inputs
+
+    def forward(self, lowres: Tensor, style_input: Tensor) -> Tensor:
+        styles = self.upsampler.style_network(style_input) if self.inputs == "noise" else style_input
+        conv_mods = self.upsampler.style_to_conv_modulations(styles)
+        conv_mods = conv_mods.split(self.upsampler.style_embed_split_dims, dim=-1)
+        return self.upsampler.unet(lowres, conv_mods)
+
+
+def onnx_model_path(checkpoint_path, inputs: str = "noise") -> Path:
+    # next to the checkpoint, keyed by its content: <stem>.<sha256[:16]>[.style].onnx
+    checkpoint_path = Path(checkpoint_path)
+    suffix = "" if inputs == "noise" else f".{inputs}"
+    return checkpoint_path.with_name(f"{checkpoint_path.stem}.{file_hash(checkpoint_path)[:16]}{suffix}.onnx")
+
+
+@torch.no_grad()
+def export_onnx(upsampler: UnetUpsampler, path, inputs: str = "noise"):
+    """
+    Exports a CPU fp32 UnetUpsampler to path, with a dynamic batch axis and its weights in a
+    single external '<name>.data' file next to it (the full model is over protobuf's 2GB).
+
+    The graph runs the convs in the 'activation' mode: plain batched convs, where the 'weight'
+    mode would need a conv with as many groups as the batch has tiles.
+    """
+    import onnx
+
+    assert upsampler.device.type == "cpu" and upsampler.dtype == torch.float32, "export needs an fp32 model on the CPU"
+    path = Path(path)
+
+    convs = list(upsampler.modulated_convs())
+    conv_modes = [conv.conv_mode for conv in convs]
+    baked = [conv.baked_weights for conv in convs]
+    upsampler.set_conv_mode("activation")
+    for conv in convs:
+        conv.baked_weights = None
+
+    size = upsampler.input_image_size
+    style_dim = upsampler.style_network.dim_in if inputs == "noise" else upsampler.style_network.dim_out
+    args = (torch.rand(1, 3, size, size), torch.randn(1, style_dim))
+
+    try:
+        with tempfile.TemporaryDirectory() as temp, warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            exported = os.path.join(temp, "model.onnx")
+            torch.onnx.export(
+                UnetExport(upsampler, inputs).eval(),
+                args,
+                exported,
+                input_names=["lowres", inputs],
+                output_names=["rgb"],
+                dynamic_axes={"lowres": {0: "batch"}, inputs: {0: "batch"}, "rgb": {0: "batch"}},
+                opset_version=OPSET_VERSION,
+                dynamo=False,
+            )
+
+            # the .onnx only shows up once the export is complete
+            model = onnx.load(exported)
+            temp_path = path.with_name(path.name + ".tmp")
+            onnx.save_model(model, temp_path, save_as_external_data=True, all_tensors_to_one_file=True, location=path.name + ".data")
+            os.replace(temp_path, path)
+    finally:
+        for conv, conv_mode, weights in zip(convs, conv_modes, baked):
+            conv.conv_mode = conv_mode
+            conv.baked_weights = weights
+
+    return path
+
+
+class OnnxAuraSR(AuraSR):
+    """
+    AuraSR running an exported (lowres, noise) graph with onnxruntime, with the same interface:
+    upscale, upscale_to_file, upscale_4x, upscale_4x_overlapped... Only the inference differs,
+    the tiling, scheduling and noise (including a fixed style_seed) are the same as AuraSR's.
+    """
+
+    engine = "onnx"
+
+    def __init__(self, config: dict[str, Any], onnx_path, providers=None, pipelined: Optional[bool] = None):
+        import onnxruntime
+
+        # no conv mode, the graph was exported in the 'activation' one
+        self.init_state(config, "fp32", None, pipelined)
+        self.style_dim = config.get("style_network", {}).get("dim_in", 128)
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(str(onnx_path), options, providers=providers or ["CPUExecutionProvider"])
+
+    @property
+    def device(self) -> torch.device:
+        return torch.device("cpu")
+
+    @property
+    def dtype(self) -> torch.dtype:
+        return torch.float32
+
+    def quantize(self):
+        print("[AuraSR-ComfyUI] cpu_int8 does not apply to the onnxruntime backend.")
+        return self
+
+    def compile(self, enabled: bool = True):
+        if enabled:
+            print("[AuraSR-ComfyUI] compile does not apply to the onnxruntime backend.")
+        return self
+
+    def set_channels_last(self, enabled: bool = True):
+        if enabled:
+            print("[AuraSR-ComfyUI] channels_last does not apply to the onnxruntime backend.")
+        return self
+
+    def set_attention_backend(self, backend: Optional[str] = None):
+        if backend is not None:
+            print("[AuraSR-ComfyUI] The attention backend does not apply to the onnxruntime backend.")
+        return self
+
+    def infer(self, model_input: Tensor, style_seed: Optional[int] = None, batch_size: Optional[int] = None) -> Tensor:
+        b = model_input.shape[0]
+        model_input = noise_augment(model_input.float().cpu(), style_seed)
+
+        # a fixed style is the style noise of the seed for every tile
+        if exists(style_seed):
+            noise = style_noise(style_seed, self.style_dim).expand(b, -1)
+        else:
+            noise = torch.randn(b, self.style_dim)
+
+        rgb, = self.session.run(None, {"lowres": model_input.numpy(), "noise": noise.contiguous().numpy()})
+        return torch.from_numpy(rgb)
@@ -0,0 +1,212 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Optional
+
+import torch
+
+from .autotune import RssSampler, rss_bytes
+
+
+# set to 1 to profile every run of the nodes, whatever their 'profile' toggle, or to 'modules' to
+# also time every part of the model with forward hooks
+PROFILE_ENV = "AURASR_PROFILE"
+
+logger = logging.getLogger("AuraSR")
+
+
+def profiling_enabled(toggle: bool = False) -> bool:
+    return toggle or os.environ.get(PROFILE_ENV, "").strip().lower() not in ("", "0", "false", "no", "off")
+
+
+def module_profiling_enabled() -> bool:
+    return os.environ.get(PROFILE_ENV, "").strip().lower() == "modules"
+
+
+class StageRecord:
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.tiles = 0
+        self.peak_memory = None
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "seconds": round(self.seconds, 6),
+            "tiles": self.tiles,
+            "peak_memory_mb": None if self.peak_memory is None else round(self.peak_memory / (1 << 20), 1),
+        }
+
+
+def module_stages(upsampler):
+    # (stage name, module) for the parts of UnetUpsampler.forward, in the order they run
+    yield "forward.style", upsampler.style_network
+    yield "forward.style", upsampler.style_to_conv_modulations
+    yield "forward.init_conv", upsampler.init_conv
+    for i, (blocks, (attn, downsample)) in enumerate(upsampler.downs):
+        for module in (*blocks, attn, downsample):
+            if module is not None:
+                yield f"forward.down{i}", module
+    for module in (upsampler.mid_block1, upsampler.mid_attn, upsampler.mid_block2):
+        yield "forward.mid", module
+    for i, (blocks, (upsample, attn)) in enumerate(upsampler.ups):
+        for module in (upsample, *blocks, attn):
+            if module is not None:
+                yield f"forward.up{i}", module
+    yield "forward.final", upsampler.final_res_block
+    yield "forward.final", upsampler.final_to_rgb
+
+
+class Profiler:
+    """
+    Wall time, tile counts and memory per stage of one node run. Off by default: the nodes only
+    create one when profiling is enabled, and AuraSR.profile() is a no-op without one.
+
+    stage() times a block of code. With modules=True, attach() also adds forward hooks timing the
+    parts of the model (down/mid/up stages...) for as long as it stays attached. On CUDA every
+    timer synchronizes the device, so the times are those of the GPU work: around the few stages
+    of a run that costs little, around every hooked module it removes the overlap the pipelined
+    scheduler relies on, which is why the module hooks are opt-in.
+
+    peak_memory_mb of a stage is the high-water mark when it last ended: of the CUDA allocator
+    since the profiler started on a GPU, of the process RSS over what it was when the profiler
+    started on the CPU (sampled by an RssSampler while any stage runs, the process-wide max RSS
+    would only show whatever the process used before). The first stage at which it jumps is the
+    one that raised it. It is None when the RSS cannot be read.
+    """
+
+    def __init__(self, device=None, modules=False):
+        self.modules = modules
+        self.stages: dict[str, StageRecord] = {}
+        self.info: dict[str, Any] = {}
+        self.scheduler: Optional[dict] = None
+        self.handles = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.start = time.perf_counter()
+        self.rss_baseline = self.rss_peak = rss_bytes()
+        self.sampler: Optional[RssSampler] = None
+        self.active_stages = 0
+        self.set_device(device or "cpu")
+
+    def set_device(self, device):
+        self.device = torch.device(device)
+        self.cuda = self.device.type == "cuda" and torch.cuda.is_available()
+        if self.cuda:
+            torch.cuda.reset_peak_memory_stats(self.device)
+
+    def sync(self):
+        if self.cuda:
+            torch.cuda.synchronize(self.device)
+
+    def peak_memory(self) -> Optional[int]:
+        if self.cuda:
+            return torch.cuda.max_memory_allocated(self.device)
+        if self.rss_baseline is None:
+            return None
+        sampler = self.sampler
+        peak = self.rss_peak if sampler is None else max(self.rss_peak, sampler.peak or 0)
+        return max(0, peak - self.rss_baseline)
+
+    @contextmanager
+    def sample_memory(self):
+        # on the CPU one RssSampler runs for as long as any stage does (stages nest and the
+        # scheduler's threads run their own), what it saw is kept in rss_peak for the whole run
+        if self.cuda or self.rss_baseline is None:
+            yield
+            return
+        with self.lock:
+            self.active_stages += 1
+            if self.sampler is None:
+                self.sampler = RssSampler().__enter__()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.active_stages -= 1
+                if self.active_stages == 0:
+                    self.sampler.__exit__(None, None, None)
+                    self.rss_peak = max(self.rss_peak, self.sampler.peak or 0)
+                    self.sampler = None
+
+    def record(self, name: str, seconds: float, tiles: int = 0):
+        peak_memory = self.peak_memory()
+        with self.lock:
+            record = self.stages.get(name)
+            if record is None:
+                record = self.stages[name] = StageRecord()
+            record.calls += 1
+            record.seconds += seconds
+            record.tiles += tiles
+            if peak_memory is not None:
+                record.peak_memory = max(record.peak_memory or 0, peak_memory)
+
+    @contextmanager
+    def stage(self, name: str, tiles: int = 0):
+        self.sync()
+        start = time.perf_counter()
+        try:
+            with self.sample_memory():
+                yield
+        finally:
+            self.sync()
+            self.record(name, time.perf_counter() - start, tiles)
+
+    def attach(self, aura_sr):
+        # per module timings of a torch model, not of the onnxruntime engine or a compiled model
+        # (hooks would break the compiled graphs)
+        upsampler = getattr(aura_sr, "upsampler", None)
+        if not self.modules or upsampler is None or aura_sr.compiled:
+            return
+
+        counted = set()
+        for name, module in module_stages(upsampler):
+            # a stage's tiles are counted once, by its first module
+            count_tiles = name not in counted
+            counted.add(name)
+            self.handles.append(module.register_forward_pre_hook(self.module_started))
+            self.handles.append(module.register_forward_hook(
+                lambda module, args, output, name=name, count_tiles=count_tiles: self.module_done(name, module, args, count_tiles)
+            ))
+
+    def detach(self):
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+
+    def module_started(self, module, args):
+        self.sync()
+        if not hasattr(self.local, "starts"):
+            self.local.starts = {}
+        self.local.starts[module] = time.perf_counter()
+
+    def module_done(self, name, module, args, count_tiles):
+        self.sync()
+        start = self.local.starts.pop(module, None)
+        if start is not None:
+            tiles = args[0].shape[0] if count_tiles and args and isinstance(args[0], torch.Tensor) else 0
+            self.record(name, time.perf_counter() - start, tiles)
+
+    def report(self) -> dict[str, Any]:
+        return {
+            **self.info,
+            "wall_s": round(time.perf_counter() - self.start, 6),
+            "stages": {name: record.as_dict() for name, record in self.stages.items()},
+            "scheduler": self.scheduler,
+        }
+
+    def log(self, report: dict[str, Any]):
+        # one json line per stage and one for the whole run, for log based telemetry
+        run = {key: report[key] for key in ("run_id", "node", "model") if key in report}
+        for name, stage in report["stages"].items():
+            logger.info("[AuraSR-ComfyUI] profile %s", json.dumps({"event": "aurasr.stage", **run, "stage": name, **stage}))
+        summary = {key: value for key, value in report.items() if key != "stages"}
+        logger.info("[AuraSR-ComfyUI] profile %s", json.dumps({"event": "aurasr.run", **summary}))
+
+
+def profile_stage(profiler: Optional[Profiler], name: str, tiles: int = 0):
+    return profiler.stage(name, tiles) if profiler is not None else nullcontext()
@@ -0,0 +1,87 @@
+import warnings
+
+import torch
+from torch import nn
+
+
+class PointwiseConv(nn.Module):
+    """
+    A 1x1 Conv2d (stride 1, no padding, no groups) as a Linear over the channels, so that it can
+    be swapped for a dynamically quantised Linear: b c h w -> b h w c -> linear -> b c h w
+    """
+
+    def __init__(self, conv: nn.Conv2d):
+        super().__init__()
+        self.linear = nn.Linear(conv.in_channels, conv.out_channels, bias=conv.bias is not None)
+        self.linear.weight.data.copy_(conv.weight.data.flatten(1))
+        if conv.bias is not None:
+            self.linear.bias.data.copy_(conv.bias.data)
+
+    def forward(self, x):
+        return self.linear(x.permute(0, 2, 3, 1)).permute(0, 3, 1, 2)
+
+
+def is_pointwise(module: nn.Module) -> bool:
+    return (
+        isinstance(module, nn.Conv2d)
+        and module.kernel_size == (1, 1)
+        and module.stride == (1, 1)
+        and module.padding in ((0, 0), "valid")
+        and module.dilation == (1, 1)
+        and module.groups == 1
+    )
+
+
+def equal_linear_to_linear(module) -> nn.Linear:
+    # EqualLinear scales its weight and bias by lr_mul on every call, bake that in
+    linear = nn.Linear(module.weight.shape[1], module.weight.shape[0], bias=hasattr(module, "bias"))
+    linear.weight.data.copy_(module.weight.data * module.lr_mul)
+    if hasattr(module, "bias"):
+        linear.bias.data.copy_(module.bias.data * module.lr_mul)
+    return linear
+
+
+def replace_modules(module: nn.Module, convert, skip=()):
+    for name, child in module.named_children():
+        if child in skip:
+            continue
+        replacement = convert(child)
+        if replacement is not None:
+            setattr(module, name, replacement)
+        else:
+            replace_modules(child, convert, skip)
+
+
+@torch.no_grad()
+def quantize_upsampler(upsampler: nn.Module) -> nn.Module:
+    """
+    Turns a CPU fp32 UnetUpsampler into the int8 CPU engine, in place: every 1x1 conv (to_qkv,
+    to_out, FeedForward, res_conv) becomes a Linear over the channels, every EqualLinear of the
+    style network a plain Linear, and all of those Linears (with style_to_conv_modulations) are
+    dynamically quantised to int8 weights, with activations quantised per batch at runtime.
+
+    The modulated 3x3 convs, the other spatial convs and final_to_rgb stay in fp32, the first
+    because their weights change with every style, the last to keep the output precision.
+    """
+    from .aura_sr import EqualLinear
+
+    assert upsampler.device.type == "cpu" and upsampler.dtype == torch.float32, "int8 quantisation needs an fp32 model on the CPU"
+
+    def convert(module):
+        if is_pointwise(module):
+            return PointwiseConv(module)
+        if isinstance(module, EqualLinear):
+            return equal_linear_to_linear(module)
+        return None
+
+    replace_modules(upsampler, convert, skip=(upsampler.final_to_rgb,))
+
+    # torch.ao.quantization is deprecated in favour of torchao but is still the only
+    # dynamic int8 path that ships with torch itself
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        from torch.ao.quantization import quantize_dynamic
+        quantize_dynamic(upsampler, {nn.Linear}, dtype=torch.qint8, inplace=True)
+
+    upsampler.clear_style_cache()
+    return upsampler
@@ -0,0 +1,231 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+import torch
+
+
+# resident models are evicted, least recently used first, past this many MB (0 or less: no limit)
+# the default fits two fp32 checkpoints of the size of AuraSR v1/v2
+DEFAULT_BUDGET_MB = 6144
+
+BUDGET_ENV = "AURASR_MODEL_BUDGET_MB"
+
+
+def budget_from_env() -> Optional[int]:
+    try:
+        budget_mb = float(os.environ.get(BUDGET_ENV, DEFAULT_BUDGET_MB))
+    except ValueError:
+        print(f"[AuraSR-ComfyUI] Invalid {BUDGET_ENV}, using {DEFAULT_BUDGET_MB} MB.")
+        budget_mb = DEFAULT_BUDGET_MB
+    return int(budget_mb * (1 << 20)) if budget_mb > 0 else None
+
+
+def tensor_bytes(value) -> int:
+    if isinstance(value, torch.Tensor):
+        return value.numel() * value.element_size()
+    if isinstance(value, (tuple, list)):  # packed parameters of the int8 engine
+        return sum(tensor_bytes(v) for v in value)
+    return 0
+
+
+def module_bytes(module: torch.nn.Module) -> int:
+    # the state dict also covers the int8 engine, whose packed weights are not parameters
+    return sum(tensor_bytes(value) for value in module.state_dict().values())
+
+
+class ModelEntry:
+    """
+    One resident model: an AuraSR (or OnnxAuraSR) with its config, the memory it takes and how many
+    runs are using it. Entries in use are never evicted.
+    """
+
+    def __init__(self, key: Hashable, aura_sr, config: dict[str, Any], upscaling_factor: int, size: Optional[int] = None):
+        self.key = key
+        self.aura_sr = aura_sr
+        self.config = config
+        self.upscaling_factor = upscaling_factor
+        self.size = size if size is not None else module_bytes(aura_sr.upsampler)
+        self.refs = 0
+        self.patcher = None
+
+    @property
+    def device(self) -> torch.device:
+        return torch.device(self.key[1])
+
+
+class ModelRegistry:
+    """
+    Models loaded by the nodes, keyed by (model path, device, dtype). The dtype part also tells the int8
+    and onnxruntime engines apart, each is its own model in memory.
+
+    acquire() loads a model on first use and hands out the resident one afterwards, release() ends a run.
+    Past the memory budget the least recently used models that no run holds are dropped.
+
+    Inside ComfyUI, models on an accelerator are wrapped in a ModelPatcher and loaded through
+    comfy.model_management: they count in its memory accounting and are moved off the device when other
+    models need the room, then moved back by the next acquire(). Models evicted here are also unloaded
+    from model_management.
+    """
+
+    def __init__(self, budget: Optional[int] = None):
+        self.budget = budget
+        self.entries: "OrderedDict[Hashable, ModelEntry]" = OrderedDict()  # least recently used first
+        self.lock = threading.RLock()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.entries
+
+    def resident_bytes(self) -> int:
+        return sum(entry.size for entry in self.entries.values())
+
+    def acquire(self, key: Hashable, load: Callable[[], Optional[ModelEntry]], expected_size: int = 0) -> Optional[ModelEntry]:
+        # load() builds the entry of a model that is not resident, it returns None when the model cannot be loaded
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                # make room before loading rather than after, so the old and new weights are not resident together
+                self.evict(expected_size)
+                entry = load()
+                if entry is None:
+                    return None
+                entry.patcher = make_patcher(entry)
+                self.entries[key] = entry
+            entry.refs += 1
+            self.entries.move_to_end(key)
+
+        try:
+            self.load_to_device(entry)
+        except:
+            self.release(entry)
+            raise
+        return entry
+
+    def release(self, entry: ModelEntry):
+        with self.lock:
+            entry.refs = max(0, entry.refs - 1)
+            self.evict()
+
+    def discard(self, entry: ModelEntry):
+        # drops a model for good, e.g. after a failed run
+        with self.lock:
+            if self.entries.get(entry.key) is entry:
+                del self.entries[entry.key]
+            unload(entry)
+
+    def evict(self, expected_size: int = 0):
+        if self.budget is None:
+            return
+        with self.lock:
+            for key, entry in list(self.entries.items()):
+                if self.resident_bytes() + expected_size <= self.budget:
+                    break
+                if entry.refs == 0:
+                    print(f"[AuraSR-ComfyUI] Unloading {os.path.basename(str(key[0]))} ({entry.size / (1 << 20):.0f} MB) to stay within the model memory budget.")
+                    del self.entries[key]
+                    unload(entry)
+
+    def clear(self):
+        with self.lock:
+            for key, entry in list(self.entries.items()):
+                if entry.refs == 0:
+                    del self.entries[key]
+                    unload(entry)
+
+    def load_to_device(self, entry: ModelEntry):
+        if entry.patcher is not None:
+            from comfy import model_management
+            try:
+                try:
+                    model_management.load_models_gpu([entry.patcher], force_full_load=True)
+                except TypeError:  # older ComfyUI
+                    model_management.load_models_gpu([entry.patcher])
+                return
+            except Exception as e:
+                print(f"[AuraSR-ComfyUI] Could not load the model through ComfyUI's model management ({e}), managing it directly.")
+                unload_from_model_management(entry.patcher)
+                entry.patcher = None
+
+        upsampler = getattr(entry.aura_sr, "upsampler", None)
+        if upsampler is not None and entry.aura_sr.device != entry.device:
+            free_device_memory(entry.size, entry.device)
+            upsampler.to(entry.device)
+
+    def offload(self, entry: ModelEntry):
+        # moves a model off its device, it stays resident in RAM
+        if entry.patcher is not None and unload_from_model_management(entry.patcher):
+            return
+        upsampler = getattr(entry.aura_sr, "upsampler", None)
+        if upsampler is not None:
+            upsampler.to("cpu")
+
+
+class PatcherModel(torch.nn.Module):
+    """
+    The module a ModelPatcher manages for an upsampler. ComfyUI assigns .device (and its own bookkeeping
+    attributes) on the model it patches, which UnetUpsampler.device, read from the weights, does not allow.
+    Moving it moves the upsampler.
+    """
+
+    def __init__(self, upsampler: torch.nn.Module):
+        super().__init__()
+        self.upsampler = upsampler
+        self.device = upsampler.device
+
+
+def make_patcher(entry: ModelEntry):
+    # only torch models on an accelerator go through model_management, RAM is the registry's budget
+    upsampler = getattr(entry.aura_sr, "upsampler", None)
+    if upsampler is None or entry.device.type == "cpu":
+        return None
+    try:
+        import comfy.model_patcher
+        from comfy import model_management
+        return comfy.model_patcher.ModelPatcher(PatcherModel(upsampler), load_device=entry.device, offload_device=model_management.unet_offload_device(), size=entry.size)
+    except Exception:  # outside of ComfyUI or an incompatible version: the registry moves the model itself
+        return None
+
+
+def unload_from_model_management(patcher) -> bool:
+    try:
+        from comfy import model_management
+        unloaded = False
+        for i in reversed(range(len(model_management.current_loaded_models))):
+            loaded = model_management.current_loaded_models[i]
+            if loaded.model is patcher:
+                loaded.model_unload()
+                model_management.current_loaded_models.pop(i)
+                unloaded = True
+        return unloaded
+    except Exception:
+        return False
+
+
+def free_device_memory(size: int, device: torch.device):
+    # asks ComfyUI to move other models off the device before this one is moved onto it
+    if device.type == "cpu":
+        return
+    try:
+        from comfy import model_management
+        model_management.free_memory(size, device)
+    except Exception:
+        pass
+
+
+def unload(entry: ModelEntry):
+    if entry.patcher is not None:
+        unload_from_model_management(entry.patcher)
+        entry.patcher = None
+    if entry.aura_sr is not None:
+        entry.aura_sr.upsampler = None
+        entry.aura_sr = None
+    try:
+        from comfy import model_management
+        model_management.soft_empty_cache()
+    except Exception:
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+
+model_registry = ModelRegistry(budget_from_env())
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy as np
+import torch
+from torch import Tensor
+
+from .utils import file_hash
+
+
+def tensor_hash(tensor: Tensor) -> str:
+    return hashlib.sha256(tensor.detach().cpu().float().contiguous().numpy().tobytes()).hexdigest()
+
+
+class ResultCache:
+    """
+    Upscaled IMAGE batches on disk, one compressed uint8 .npz per result, keyed by a hash of
+    everything the output depends on. Least recently used results (by file mtime, refreshed on
+    every hit) are deleted when the folder grows past capacity bytes.
+
+    uint8 is what the images end up saved as, a hit can differ from a fresh run by the rounding
+    to 1/255.
+    """
+
+    def __init__(self, directory, capacity: int):
+        self.directory = Path(directory)
+        self.capacity = capacity
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(**parts: Any) -> str:
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+    def model_hash(self, model_path) -> str:
+        # file_hash of a checkpoint, also kept in the folder per (path, size, mtime) so it is not read
+        # whole again after a restart, which would cost about as much as loading it
+        stat = os.stat(model_path)
+        entry = f"{os.path.abspath(model_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+        hashes_path = self.directory / "model_hashes.json"
+        with self.lock:
+            try:
+                hashes = json.loads(hashes_path.read_text())
+            except (OSError, ValueError):
+                hashes = {}
+            if entry not in hashes:
+                # the hashes of earlier versions of the file are of no use anymore
+                prefix = entry.rsplit("|", 2)[0] + "|"
+                hashes = {k: v for k, v in hashes.items() if not k.startswith(prefix)}
+                hashes[entry] = file_hash(model_path)
+                self.directory.mkdir(parents=True, exist_ok=True)
+                temp_path = hashes_path.with_suffix(f".{os.getpid()}.tmp")
+                temp_path.write_text(json.dumps(hashes, indent=2))
+                os.replace(temp_path, hashes_path)
+            return hashes[entry]
+
+    def path(self, key: str) -> Path:
+        return self.directory / f"{key}.npz"
+
+    def get(self, key: str) -> Optional[Tensor]:
+        path = self.path(key)
+        try:
+            with np.load(path) as data:
+                images = data["images"]
+            os.utime(path)  # most recently used
+        except (OSError, KeyError, ValueError):
+            return None
+        return torch.from_numpy(images).float().div_(255)
+
+    def put(self, key: str, images: Tensor):
+        images = (images.detach().cpu().float() * 255).round_().clamp_(0, 255).to(torch.uint8).numpy()
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        # written next to its final name and renamed, so a reader never sees a partial file
+        fd, temp_path = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(f, images=images)
+            os.replace(temp_path, self.path(key))
+        except:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        with self.lock:
+            files = []
+            for path in self.directory.glob("*.npz"):
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime_ns, stat.st_size, path))
+
+            size = sum(file_size for _, file_size, _ in files)
+            for _, file_size, path in sorted(files):
+                if size <= self.capacity:
+                    break
+                try:
+                    path.unlink()
+                except OSError:
+                    continue
+                size -= file_size
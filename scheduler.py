@@ -0,0 +1,220 @@
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+
+STAGES = ("stage", "infer", "merge")
+
+
+class StageStats:
+    def __init__(self, threads=1):
+        self.threads = threads
+        self.busy = 0.0
+        self.batches = 0
+        self.tiles = 0
+        self.lock = threading.Lock()
+
+    def add(self, seconds, tiles):
+        with self.lock:
+            self.busy += seconds
+            self.batches += 1
+            self.tiles += tiles
+
+
+class TileScheduler:
+    """
+    Runs batches of tiles from one or more TileGrids through three stages:
+
+        stage - gather the batch on the host and copy it to the device (through pinned memory on CUDA)
+        infer - run the model
+        merge - bring the output back to the host and write it into its grid
+
+    Batches are filled up to max_batch_size across the boundaries of the grids given to one run() call.
+
+    pipelined=True runs staging on a thread pool and merging on a single worker thread (so writes land
+    in order), connected to inference through bounded queues of queue_size batches: the next batches are
+    staged and the previous ones merged while the model runs. pipelined=False runs the very same stages
+    inline, one batch after the other, which is deterministic on any device. The default pipelines only
+    when a real accelerator is used.
+
+    Tiles are converted to dtype (the model's) before they are staged, so reduced precision models
+    also move half the bytes to the device and back.
+
+    Busy time is accumulated per stage over every run() call, idle time is the rest of the wall time of
+    the threads serving that stage.
+
+    With a cache (tile_cache.TileCache), each batch is looked up when it is staged: only the tiles
+    without a cached output (and only once if repeated in the batch) go to the model, the merge puts
+    the cached outputs back in their place and caches the new ones. cache_namespace goes into the
+    keys, with everything other than the tile the output depends on.
+    """
+
+    def __init__(self, infer_fn, device, max_batch_size=8, pipelined=None, queue_size=2, workers=2, dtype=torch.float32, cache=None, cache_namespace=b""):
+        self.infer_fn = infer_fn
+        self.device = torch.device(device)
+        self.dtype = dtype
+        self.cache = cache
+        self.cache_namespace = cache_namespace
+        self.cache_lookups = 0
+        self.cache_reused = 0
+        self.max_batch_size = max_batch_size
+        self.accelerated = self.device.type == "cuda"
+        self.pipelined = self.accelerated if pipelined is None else pipelined
+        self.queue_size = max(1, queue_size)
+        self.workers = max(1, workers)
+
+        self.elapsed = 0.0
+        self.lock = threading.Lock()
+        self.stats = {
+            "stage": StageStats(self.workers if self.pipelined else 1),
+            "infer": StageStats(),
+            "merge": StageStats(),
+        }
+
+    def plan(self, grids):
+        # a batch is a list of (grid, tile indices) parts, grids are consumed lazily
+        batch, size = [], 0
+        for grid in grids:
+            if len(grid.indices) == 0:
+                grid.done()
+                continue
+
+            indices = grid.indices
+            while len(indices) > 0:
+                take = indices[:self.max_batch_size - size]
+                indices = indices[len(take):]
+                batch.append((grid, take))
+                size += len(take)
+
+                if size == self.max_batch_size:
+                    yield batch
+                    batch, size = [], 0
+
+        if batch:
+            yield batch
+
+    def run(self, grids):
+        batches = self.plan(grids)
+
+        start = time.perf_counter()
+        if self.pipelined:
+            self.run_pipelined(batches)
+        else:
+            for batch in batches:
+                tiles, lookup = self.stage(batch)
+                self.merge(batch, *self.infer(tiles), lookup)
+        self.elapsed += time.perf_counter() - start
+
+    def run_pipelined(self, batches):
+        batches = iter(batches)
+        staged = deque()
+        merges = deque()
+
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="aurasr-stage") as stage_pool, \
+             ThreadPoolExecutor(1, thread_name_prefix="aurasr-merge") as merge_pool:
+
+            def submit_next():
+                batch = next(batches, None)
+                if batch is not None:
+                    staged.append((batch, stage_pool.submit(self.stage, batch)))
+
+            for _ in range(self.queue_size):
+                submit_next()
+
+            while staged:
+                batch, future = staged.popleft()
+                tiles, lookup = future.result()
+                submit_next()
+
+                output, event = self.infer(tiles)
+
+                # bounded write-back queue, inference waits if merging falls behind
+                while len(merges) >= self.queue_size:
+                    merges.popleft().result()
+                merges.append(merge_pool.submit(self.merge, batch, output, event, lookup))
+
+            while merges:
+                merges.popleft().result()
+
+    def stage(self, batch):
+        start = time.perf_counter()
+
+        parts = [grid.gather(indices) for grid, indices in batch]
+        tiles = parts[0] if len(parts) == 1 else torch.cat(parts)
+
+        lookup = None
+        if self.cache is not None:
+            lookup = self.cache.lookup(tiles, self.cache_namespace)
+            tiles = tiles[lookup.compute]
+            with self.lock:
+                self.cache_lookups += len(lookup.keys)
+                self.cache_reused += len(lookup.keys) - len(lookup.compute)
+
+        tiles = tiles.to(self.dtype)
+        if self.accelerated:
+            tiles = tiles.pin_memory()
+        tiles = tiles.to(self.device, non_blocking=self.accelerated)
+
+        self.stats["stage"].add(time.perf_counter() - start, len(tiles))
+        return tiles, lookup
+
+    def infer(self, tiles):
+        # every tile of the batch may be cached
+        if len(tiles) == 0:
+            return None, None
+
+        start = time.perf_counter()
+
+        output = self.infer_fn(tiles)
+
+        # start the copy back right away, the merge worker waits on the event
+        event = None
+        if self.accelerated:
+            host = torch.empty(output.shape, dtype=output.dtype, pin_memory=True)
+            host.copy_(output, non_blocking=True)
+            event = torch.cuda.Event()
+            event.record()
+            output = host
+
+        self.stats["infer"].add(time.perf_counter() - start, len(tiles))
+        return output, event
+
+    def merge(self, batch, output, event=None, lookup=None):
+        start = time.perf_counter()
+
+        if event is not None:
+            event.synchronize()
+        if output is not None:
+            output = output.cpu()
+        if lookup is not None:
+            output = lookup.complete(output)
+
+        offset = 0
+        for grid, indices in batch:
+            grid.scatter(indices, output[offset:offset + len(indices)])
+            offset += len(indices)
+
+        self.stats["merge"].add(time.perf_counter() - start, len(output))
+
+    def report(self):
+        report = {"elapsed_s": round(self.elapsed, 4)}
+        for name in STAGES:
+            stats = self.stats[name]
+            report[name] = {
+                "busy_s": round(stats.busy, 4),
+                "idle_s": round(max(0.0, self.elapsed * stats.threads - stats.busy), 4),
+                "batches": stats.batches,
+                "tiles": stats.tiles,
+            }
+        tiles = self.stats["infer"].tiles
+        report["tiles_per_s"] = round(tiles / self.elapsed, 2) if self.elapsed > 0 else 0.0
+        if self.cache is not None:
+            report["tile_cache"] = {
+                "lookups": self.cache_lookups,
+                "reused": self.cache_reused,
+                "hit_rate": round(self.cache_reused / self.cache_lookups, 4) if self.cache_lookups else 0.0,
+            }
+        return report
@@ -0,0 +1,113 @@
+import struct
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+
+class RowWriter:
+    """
+    Receives an (height, width, 3) uint8 image top to bottom, in bands of whole rows,
+    so the complete image never has to be held in memory.
+    """
+
+    suffix = ""
+
+    def __init__(self, path, height: int, width: int):
+        self.path = Path(path)
+        self.height = height
+        self.width = width
+        self.rows_written = 0
+
+    def write(self, rows: np.ndarray):
+        assert rows.shape[1:] == (self.width, 3) and rows.dtype == np.uint8, f"expected (n, {self.width}, 3) uint8 rows"
+        assert self.rows_written + len(rows) <= self.height, "more rows than the image height"
+        self.write_rows(rows)
+        self.rows_written += len(rows)
+
+    def write_rows(self, rows: np.ndarray):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class NpyRowWriter(RowWriter):
+    # a memory-mapped .npy file, np.load(path, mmap_mode="r") reads it back without loading it
+    suffix = ".npy"
+
+    def __init__(self, path, height: int, width: int):
+        super().__init__(path, height, width)
+        self.array = np.lib.format.open_memmap(self.path, mode="w+", dtype=np.uint8, shape=(height, width, 3))
+
+    def write_rows(self, rows: np.ndarray):
+        self.array[self.rows_written:self.rows_written + len(rows)] = rows
+
+    def close(self):
+        if self.array is not None:
+            self.array.flush()
+            self.array = None
+
+
+class PngRowWriter(RowWriter):
+    # 8 bit RGB png, the rows are deflated as they come in and written out in IDAT chunks
+    suffix = ".png"
+
+    def __init__(self, path, height: int, width: int, compress_level: int = 4, chunk_size: int = 1 << 20):
+        super().__init__(path, height, width)
+        self.compressor = zlib.compressobj(compress_level)
+        self.chunk_size = chunk_size
+        self.pending = []
+        self.pending_size = 0
+
+        self.file = open(self.path, "wb")
+        self.file.write(b"\x89PNG\r\n\x1a\n")
+        self.write_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+
+    def write_chunk(self, kind: bytes, data: bytes):
+        self.file.write(struct.pack(">I", len(data)))
+        self.file.write(kind)
+        self.file.write(data)
+        self.file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind))))
+
+    def write_data(self, data: bytes, flush=False):
+        if data:
+            self.pending.append(data)
+            self.pending_size += len(data)
+        if self.pending_size >= self.chunk_size or (flush and self.pending_size > 0):
+            self.write_chunk(b"IDAT", b"".join(self.pending))
+            self.pending, self.pending_size = [], 0
+
+    def write_rows(self, rows: np.ndarray):
+        # every scanline starts with its filter type, 0 (none)
+        scanlines = np.zeros((len(rows), 1 + self.width * 3), dtype=np.uint8)
+        scanlines[:, 1:] = rows.reshape(len(rows), -1)
+        self.write_data(self.compressor.compress(scanlines.tobytes()))
+
+    def close(self):
+        if self.file is None:
+            return
+        self.write_data(self.compressor.flush(), flush=True)
+        self.write_chunk(b"IEND", b"")
+        self.file.close()
+        self.file = None
+
+
+ROW_WRITERS = {
+    "png": PngRowWriter,
+    "npy": NpyRowWriter,
+}
+
+
+def open_row_writer(path, height: int, width: int, format: str = None) -> RowWriter:
+    # the format defaults to the file's extension
+    format = format or Path(path).suffix.lstrip(".").lower()
+    if format not in ROW_WRITERS:
+        raise ValueError(f"format must be one of {tuple(ROW_WRITERS)} but got {format!r}")
+    return ROW_WRITERS[format](path, height, width)
@@ -0,0 +1,107 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import torch
+from torch import Tensor
+
+
+class TileLookup:
+    """
+    The cache lookup of one batch of input tiles: which tiles have a cached output, and which ones
+    have to run through the model. Tiles repeated within the batch only run once.
+    """
+
+    def __init__(self, cache: "TileCache", keys: list[bytes], hits: dict[int, Tensor], compute: list[int], sources: list[int]):
+        self.cache = cache
+        self.keys = keys
+        self.hits = hits
+        self.compute = compute  # batch indices of the tiles to run
+        self.sources = sources  # batch index -> position in compute, for the tiles that are not hits
+
+    def complete(self, computed: Optional[Tensor]) -> Tensor:
+        # the output of the whole batch from the output of the computed tiles, which gets cached
+        if computed is not None:
+            for position, i in enumerate(self.compute):
+                self.cache.put(self.keys[i], computed[position])
+
+        like = computed[0] if computed is not None else next(iter(self.hits.values()))
+        output = torch.empty((len(self.keys), *like.shape), dtype=like.dtype)
+        for i in range(len(self.keys)):
+            output[i] = self.hits[i] if i in self.hits else computed[self.sources[i]]
+        return output
+
+
+class TileCache:
+    """
+    LRU cache of upscaled tiles, content addressed: the key is a hash of the input tile's bytes and
+    of a namespace for everything else the output depends on (model, dtype, style seed...). Flat or
+    repeated regions, and the reflect padding around the image, then only run through the model once.
+
+    Only valid for a deterministic model, i.e. with a fixed style seed. Outputs are kept on the CPU
+    up to capacity bytes.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.entries: "OrderedDict[bytes, Tensor]" = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def key(self, tile: Tensor, namespace: bytes) -> bytes:
+        digest = hashlib.blake2b(namespace, digest_size=16)
+        digest.update(tile.contiguous().numpy().tobytes())
+        return digest.digest()
+
+    def lookup(self, tiles: Tensor, namespace: bytes) -> TileLookup:
+        # tiles: the (b, c, h, w) input batch on the host
+        keys = [self.key(tile, namespace) for tile in tiles]
+        hits, compute, sources, first = {}, [], [], {}
+
+        with self.lock:
+            for i, key in enumerate(keys):
+                output = self.entries.get(key)
+                if output is not None:
+                    self.entries.move_to_end(key)
+                    hits[i] = output
+                    sources.append(-1)
+                elif key in first:
+                    sources.append(sources[first[key]])
+                else:
+                    first[key] = i
+                    sources.append(len(compute))
+                    compute.append(i)
+
+        return TileLookup(self, keys, hits, compute, sources)
+
+    def put(self, key: bytes, output: Tensor):
+        output = output.detach().clone()
+        size = output.numel() * output.element_size()
+        if size > self.capacity:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return
+            self.entries[key] = output
+            self.size += size
+            while self.size > self.capacity:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.numel() * evicted.element_size()
+
+    def resize(self, capacity: int):
+        with self.lock:
+            self.capacity = capacity
+            while self.size > self.capacity and self.entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.numel() * evicted.element_size()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
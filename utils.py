@@ -1,3 +1,5 @@
+import os
+import hashlib
 import torch
 import numpy as np
 from PIL import Image
@@ -82,9 +84,28 @@ def paste_alpha(image, alpha):
     image.putalpha(alpha)
     return image
 
+def paste_alpha_tensor(image, alpha):
+    # (B, H, W, 3) image + PIL 'L' alpha -> (B, H, W, 4)
+    alpha = pil2tensor(alpha).unsqueeze(-1).to(image)
+    return torch.cat((image[..., :3], alpha.expand(len(image), -1, -1, -1)), dim=-1)
+
 
 def prepare_input(image, transparency_mask, reapply_transparency, upscaling_factor):
     resized_alpha = get_resized_alpha(image, transparency_mask, upscaling_factor) if reapply_transparency else None
     image = to_pil(image).convert("RGB")
     return image, resized_alpha
 
+
+file_hashes = {}
+
+def file_hash(path):
+    # sha256 of a (large) file, remembered per (path, size, mtime) so each checkpoint is only read once
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in file_hashes:
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 24), b""):
+                sha.update(chunk)
+        file_hashes[key] = sha.hexdigest()
+    return file_hashes[key]